@@ -0,0 +1,45 @@
+import sys
+import importlib.util
+from pathlib import Path
+
+import pytest
+
+
+SCRIPT_PATH = Path(__file__).resolve().parent.parent / 'zzz_fix.2.0G_by_HC.py'
+
+
+def load_script():
+    # The script isn't an importable module name, so it's loaded from its path
+    spec = importlib.util.spec_from_file_location('zzz_fix', SCRIPT_PATH)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules['zzz_fix'] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+@pytest.fixture(scope='session')
+def zzz():
+    module = load_script()
+    yield module
+    if module.buffer_pool is not None:
+        module.buffer_pool.shutdown()
+
+
+@pytest.fixture(autouse=True)
+def fresh_run(zzz):
+    # Every test is a run of its own
+    zzz.global_modified_buffers = {}
+    yield
+    zzz.global_modified_buffers = {}
+
+
+def write_mod(folder, files):
+    # {relative path: str (ini text) or bytes (buffer)}
+    for relpath, content in files.items():
+        filepath = folder / relpath
+        filepath.parent.mkdir(parents=True, exist_ok=True)
+        if isinstance(content, str):
+            filepath.write_text(content, encoding='utf-8', newline='')
+        else:
+            filepath.write_bytes(content)
+    return folder
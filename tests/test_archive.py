@@ -0,0 +1,67 @@
+import io
+import zipfile
+
+from conftest import write_mod
+from test_checkpoint import HAIR_BUFFER, get_hair_ini, read_mods
+
+
+README = b'Hair mod for Caesar\n' * 50
+
+
+class UnseekableFile(io.BytesIO):
+    # Streamed archives get a data descriptor after the data of every member
+    def seek(self, *args):
+        raise OSError('unseekable')
+
+
+def write_archive(filepath, streamed=False):
+    f = UnseekableFile() if streamed else io.BytesIO()
+    with zipfile.ZipFile(f, 'w') as archive:
+        archive.writestr('Caesar/Caesar.ini', get_hair_ini('Caesar'), zipfile.ZIP_DEFLATED)
+        archive.writestr('Caesar/Hair.buf', HAIR_BUFFER, zipfile.ZIP_DEFLATED)
+        archive.writestr('Caesar/readme.txt', README, zipfile.ZIP_DEFLATED)
+        archive.writestr('Caesar/preview.png', b'\x89PNG' + bytes(range(256)), zipfile.ZIP_STORED)
+    filepath.write_bytes(f.getvalue())
+    return filepath
+
+
+def get_fixed_folder(zzz, folder):
+    write_mod(folder, {'Caesar/Caesar.ini': get_hair_ini('Caesar'), 'Caesar/Hair.buf': HAIR_BUFFER})
+    zzz.process_folder(str(folder))
+    zzz.global_modified_buffers = {}
+    return read_mods(folder)
+
+
+def check_fixed_archive(zzz, tmp_path, streamed):
+    archive_path = write_archive(tmp_path / 'Caesar.zip', streamed)
+    original = archive_path.read_bytes()
+
+    results = zzz.process_archive(str(archive_path))
+
+    assert results == {'Caesar/Caesar.ini': True}
+    assert archive_path.read_bytes() == original
+    expected = get_fixed_folder(zzz, tmp_path / 'folder')
+    with zipfile.ZipFile(tmp_path / 'Caesar.fixed.zip') as archive:
+        assert archive.testzip() is None
+        assert archive.namelist() == ['Caesar/Caesar.ini', 'Caesar/Hair.buf', 'Caesar/readme.txt', 'Caesar/preview.png']
+        assert archive.read('Caesar/Caesar.ini') == expected['Caesar/Caesar.ini']
+        assert archive.read('Caesar/Hair.buf') == expected['Caesar/Hair.buf']
+        assert archive.read('Caesar/Hair.buf') != HAIR_BUFFER
+        assert archive.read('Caesar/readme.txt') == README
+        assert archive.getinfo('Caesar/preview.png').compress_type == zipfile.ZIP_STORED
+
+
+def test_fixed_archive_is_valid(zzz, tmp_path):
+    check_fixed_archive(zzz, tmp_path, streamed=False)
+
+
+def test_fixed_archive_keeps_data_descriptors(zzz, tmp_path):
+    check_fixed_archive(zzz, tmp_path, streamed=True)
+
+
+def test_dry_run_writes_no_archive(zzz, tmp_path):
+    archive_path = write_archive(tmp_path / 'Caesar.zip')
+
+    zzz.process_archive(str(archive_path), dry_run=True)
+
+    assert not (tmp_path / 'Caesar.fixed.zip').exists()
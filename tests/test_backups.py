@@ -0,0 +1,65 @@
+import pytest
+
+from conftest import write_mod
+from test_checkpoint import read_mods
+
+
+BELLE_INI = '''[TextureOverrideBelleBlend]
+hash = d2844c01
+vb2 = ResourceBelleBlend
+
+[TextureOverrideBelleTexcoord]
+hash = caf95576
+vb1 = ResourceBelleTexcoord
+
+[ResourceBelleBlend]
+type = Buffer
+stride = 32
+filename = BelleBlend.buf
+'''
+
+
+@pytest.fixture
+def belle_mod(zzz, tmp_path):
+    # The blend remap of the Belle texcoord hash keeps the stride, the buffer gets patched
+    return write_mod(tmp_path / 'mods', {
+        'Belle/Belle.ini': BELLE_INI,
+        'Belle/BelleBlend.buf': zzz.get_blend_remap_buffer(2000),
+    })
+
+
+def test_restore_after_a_patched_buffer(zzz, belle_mod):
+    original = read_mods(belle_mod)
+    zzz.process_folder(str(belle_mod))
+
+    fixed = read_mods(belle_mod)
+    assert fixed['Belle/BelleBlend.buf'] != original['Belle/BelleBlend.buf']
+    records = zzz.BackupStore.open(str(belle_mod)).records
+    assert {(record['path'], record['kind']) for record in records} == {('Belle/Belle.ini', 'file'), ('Belle/BelleBlend.buf', 'patch')}
+
+    results = zzz.restore_run(str(belle_mod))
+
+    assert results == {'Belle/Belle.ini': True, 'Belle/BelleBlend.buf': True}
+    assert read_mods(belle_mod) == original
+
+
+def test_restore_a_given_run(zzz, belle_mod):
+    original = read_mods(belle_mod)
+    zzz.process_folder(str(belle_mod))
+    fixed = read_mods(belle_mod)
+    zzz.restore_run(str(belle_mod))
+    zzz.global_modified_buffers = {}
+    zzz.process_folder(str(belle_mod))
+    first_run, second_run = zzz.BackupStore.open(str(belle_mod)).get_runs()
+
+    with pytest.raises(Exception, match='There is no run'):
+        zzz.restore_run(str(belle_mod), first_run - 1)
+    assert read_mods(belle_mod) == fixed
+
+    zzz.restore_run(str(belle_mod), str(second_run))
+    assert read_mods(belle_mod) == original
+
+
+def test_restore_without_backups(zzz, belle_mod):
+    with pytest.raises(Exception, match='There are no backups'):
+        zzz.restore_run(str(belle_mod))
@@ -0,0 +1,47 @@
+from test_backups import BELLE_INI
+from test_checkpoint import HAIR_BUFFER, get_hair_ini
+
+
+# Hair texcoord remap and body blend remap, two buffers to convert
+MOD_INI = get_hair_ini('Caesar') + '\n' + BELLE_INI
+
+
+def get_buffers(zzz):
+    blend_buffer = zzz.get_blend_remap_buffer(500)
+    return {'Hair.buf': HAIR_BUFFER, 'BelleBlend.buf': blend_buffer}
+
+
+def fix_mod(zzz, monkeypatch, workers):
+    monkeypatch.setattr(zzz, 'buffer_workers', workers)
+    buffers = get_buffers(zzz)
+    requested = []
+    def buffer_provider(filename):
+        requested.append(filename)
+        return buffers[filename]
+
+    ini = zzz.fix_ini_text(MOD_INI, buffer_provider)
+    assert sorted(requested) == sorted(buffers)
+    return ini
+
+
+def test_parallel_conversions_match_serial_ones(zzz, monkeypatch, capsys):
+    serial = fix_mod(zzz, monkeypatch, 1)
+    assert 'in parallel' not in capsys.readouterr().out
+
+    parallel = fix_mod(zzz, monkeypatch, 2)
+    assert 'Converting 2 buffers in parallel' in capsys.readouterr().out
+
+    assert parallel.modified_buffers == serial.modified_buffers
+    assert parallel.content == serial.content
+    buffers = get_buffers(zzz)
+    for filename, buffer in parallel.modified_buffers.items():
+        assert buffer != buffers[filename]
+        assert parallel.original_buffers[filename] == buffers[filename]
+
+
+def test_dry_runs_convert_nothing(zzz):
+    buffers = get_buffers(zzz)
+    ini = zzz.fix_ini_text(MOD_INI, buffers.get, dry_run=True)
+
+    assert len(ini.buffer_conversions) == 2
+    assert ini.modified_buffers == {}
@@ -0,0 +1,67 @@
+import random
+
+import pytest
+
+
+def get_changed_buffer(size, changes, seed=0):
+    rng = random.Random(seed)
+    old = bytes(rng.randrange(256) for _ in range(size))
+    new = bytearray(old)
+    for offset, value in changes:
+        new[offset:offset + len(value)] = value
+    return old, bytes(new)
+
+
+def test_diff_apply_undo_round_trip(zzz, tmp_path):
+    old, new = get_changed_buffer(200000, [(0, b'\xff\xfe'), (70000, b'\x01' * 40), (199990, b'\x00' * 10)])
+    buffer_filepath = tmp_path / 'Body.buf'
+    buffer_filepath.write_bytes(old)
+
+    patch = zzz.BufferPatch.diff(old, new)
+    undo_patch = patch.get_undo_patch(old)
+    patch.apply(buffer_filepath, new)
+    assert buffer_filepath.read_bytes() == new
+    assert patch.patched_bytes() < 100
+    assert len(undo_patch) == patch.get_undo_patch_size()
+
+    zzz.apply_undo_patch(undo_patch, buffer_filepath)
+    assert buffer_filepath.read_bytes() == old
+
+
+def test_identical_buffers_have_no_ranges(zzz):
+    old, _ = get_changed_buffer(1000, [])
+    assert zzz.BufferPatch.diff(old, old).ranges == []
+
+
+def test_resized_buffers_are_not_patched(zzz):
+    assert zzz.BufferPatch.diff(b'\x00' * 8, b'\x00' * 12) is None
+
+
+def test_undo_patch_rejects_a_buffer_of_another_size(zzz, tmp_path):
+    old, new = get_changed_buffer(64, [(10, b'\x00\x01')])
+    undo_patch = zzz.BufferPatch.diff(old, new).get_undo_patch(old)
+    buffer_filepath = tmp_path / 'Body.buf'
+    buffer_filepath.write_bytes(new + b'\x00')
+
+    with pytest.raises(Exception, match='does not match the patch'):
+        zzz.apply_undo_patch(undo_patch, buffer_filepath)
+
+
+def test_blend_remaps_are_sparse(zzz):
+    old = zzz.get_blend_remap_buffer(5000)
+    remaps = [
+        command[0](*command[1])
+        for commands in zzz.all_hash_commands.values()
+        for command in commands
+        if command[0] is zzz.update_buffer_blend_indices
+    ]
+    assert remaps
+
+    for remap in remaps:
+        new = zzz.BlendIndicesRemap(remap.old_indices, remap.new_indices).convert(old)
+        patch = zzz.BufferPatch.diff(old, new)
+        patched = bytearray(old)
+        for start, end in patch.ranges:
+            patched[start:end] = new[start:end]
+        assert patched == new
+        assert patch.is_sparse()
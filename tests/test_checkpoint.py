@@ -0,0 +1,115 @@
+import shutil
+import struct
+
+import pytest
+
+from conftest import write_mod
+
+
+def get_hair_ini(title):
+    return '''[TextureOverride{0}Texcoord]
+hash = af291513
+vb1 = Resource{0}Texcoord
+
+[Resource{0}Texcoord]
+type = Buffer
+stride = 20
+filename = Hair.buf
+'''.format(title)
+
+
+HAIR_BUFFER = b''.join(
+    struct.pack('<4B2e2f2e', i % 256, 0, 0, 255, i / 100, 1 - i / 100, .5, i / 50, .25, .75)
+    for i in range(1, 71)
+)
+
+
+def write_mods(folder):
+    # Both inis of the Caesar mod remap the same buffer, only the first one to run gets to
+    return write_mod(folder, {
+        'Caesar/Caesar.ini': get_hair_ini('Caesar'),
+        'Caesar/CaesarAlt.ini': get_hair_ini('CaesarAlt'),
+        'Caesar/Hair.buf': HAIR_BUFFER,
+        'Lucy/Lucy.ini': get_hair_ini('Lucy'),
+        'Lucy/Hair.buf': HAIR_BUFFER,
+    })
+
+
+def read_mods(folder):
+    return {
+        filepath.relative_to(folder).as_posix(): filepath.read_bytes()
+        for filepath in sorted(folder.rglob('*'))
+        if filepath.is_file() and '.zzzfix' not in filepath.parts
+    }
+
+
+def interrupt_second_save(zzz, monkeypatch, folder):
+    save = zzz.Ini.save
+    saved = []
+    def interrupted_save(ini, timestamp=None):
+        saved.append(ini.filepath)
+        if len(saved) == 2:
+            raise KeyboardInterrupt
+        return save(ini, timestamp)
+
+    monkeypatch.setattr(zzz.Ini, 'save', interrupted_save)
+    with pytest.raises(KeyboardInterrupt):
+        zzz.process_folder(str(folder))
+    monkeypatch.setattr(zzz.Ini, 'save', save)
+    assert (folder / zzz.checkpoint_filename).exists()
+
+
+@pytest.fixture
+def expected_mods(zzz, tmp_path):
+    folder = write_mods(tmp_path / 'uninterrupted')
+    zzz.process_folder(str(folder))
+    zzz.global_modified_buffers = {}
+    return read_mods(folder)
+
+
+def test_resume_after_an_interrupted_save(zzz, tmp_path, monkeypatch, expected_mods):
+    folder = write_mods(tmp_path / 'mods')
+    interrupt_second_save(zzz, monkeypatch, folder)
+
+    # The resumed run is a new process
+    zzz.global_modified_buffers = {}
+    zzz.process_folder(str(folder), resume=True)
+
+    assert read_mods(folder) == expected_mods
+    assert not (folder / zzz.checkpoint_filename).exists()
+
+
+def test_resume_after_moving_the_folder(zzz, tmp_path, monkeypatch, expected_mods):
+    folder = write_mods(tmp_path / 'mods')
+    interrupt_second_save(zzz, monkeypatch, folder)
+
+    moved_folder = tmp_path / 'moved'
+    shutil.move(str(folder), str(moved_folder))
+    zzz.global_modified_buffers = {}
+    zzz.process_folder(str(moved_folder), resume=True)
+
+    assert read_mods(moved_folder) == expected_mods
+
+
+def test_buffer_fixes_follow_the_moved_folder(zzz, tmp_path):
+    folder = write_mods(tmp_path / 'mods')
+    ini = zzz.Ini(str(folder / 'Caesar' / 'Caesar.ini'))
+    fix_ids = ['13_Caesar_hair-texcoord_remap']
+    checkpoint = zzz.Checkpoint.start(str(folder), zzz.find_inis(str(folder)))
+    checkpoint.modified_buffers = {ini.get_buffer_key('Hair.buf'): fix_ids}
+    checkpoint.write()
+
+    moved_folder = tmp_path / 'moved'
+    shutil.move(str(folder), str(moved_folder))
+    zzz.global_modified_buffers = {}
+    zzz.Checkpoint.start(str(moved_folder), zzz.find_inis(str(moved_folder)), resume=True)
+
+    moved_ini = zzz.Ini(str(moved_folder / 'Caesar' / 'Caesar.ini'))
+    assert zzz.global_modified_buffers == {moved_ini.get_buffer_key('Hair.buf'): fix_ids}
+
+
+def test_dry_runs_can_not_be_resumed(zzz, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr('sys.argv', ['zzz_fix.py', '--resume', '--dry-run'])
+    with pytest.raises(Exception, match='--resume can not be combined with --dry-run'):
+        zzz.main()
@@ -0,0 +1,57 @@
+import os
+
+from test_checkpoint import HAIR_BUFFER, get_hair_ini
+
+
+LUCY_INI = '''[TextureOverrideLucyHair]
+hash = b50eb71c
+this = ResourceLucyADiffuse
+'''
+
+
+def test_fixes_ini_text_and_buffers_in_memory(zzz, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    requested = []
+    def buffer_provider(filename):
+        requested.append(filename)
+        return HAIR_BUFFER
+
+    ini = zzz.fix_ini_text(get_hair_ini('Caesar'), buffer_provider)
+
+    assert 'hash = 72537fa3' in ini.content
+    assert requested == ['Hair.buf']
+    assert list(ini.modified_buffers) == ['Hair.buf']
+    assert ini.modified_buffers['Hair.buf'] != HAIR_BUFFER
+    assert os.listdir(tmp_path) == []
+
+
+def test_buffer_filenames_are_resolved_relative_to_the_ini(zzz):
+    requested = []
+    def buffer_provider(filename):
+        requested.append(filename)
+        return HAIR_BUFFER
+
+    ini = zzz.fix_ini_text(get_hair_ini('Caesar'), buffer_provider, filepath='Mods/Caesar/Caesar.ini')
+
+    assert requested == ['Mods/Caesar/Hair.buf']
+    assert list(ini.modified_buffers) == ['Mods/Caesar/Hair.buf']
+
+
+def test_inis_sharing_fixed_buffers_fix_them_once(zzz):
+    fixed_buffers = {}
+    first = zzz.fix_ini_text(get_hair_ini('Caesar'), lambda filename: HAIR_BUFFER, filepath='Caesar/Caesar.ini', fixed_buffers=fixed_buffers)
+    buffer = first.modified_buffers['Caesar/Hair.buf']
+
+    second = zzz.fix_ini_text(get_hair_ini('CaesarAlt'), lambda filename: buffer, filepath='Caesar/CaesarAlt.ini', fixed_buffers=fixed_buffers)
+
+    assert 'hash = 72537fa3' in second.content
+    assert second.modified_buffers.get('Caesar/Hair.buf', buffer) == buffer
+
+
+def test_inis_without_buffers_never_call_the_provider(zzz):
+    def buffer_provider(filename):
+        raise AssertionError(filename)
+
+    ini = zzz.fix_ini_text(LUCY_INI, buffer_provider)
+
+    assert ini.modified_buffers == {}
@@ -0,0 +1,59 @@
+import pytest
+
+
+PLUGIN = '''
+@dataclass
+class XorConversion():
+    key: int
+
+    def convert(self, buffer):
+        return bytes(byte ^ self.key for byte in buffer)
+
+
+hash_commands = {
+    'feedf00d': [(log, ('Plugin hash',))],
+}
+'''
+
+
+@pytest.fixture
+def fix_tables(zzz, monkeypatch):
+    # use_fix_tables replaces the tables of the script, they're put back after the test
+    for name in ('all_hash_commands', 'hash_commands', 'hash_schedule', 'hash_equivalence', 'known_hashes', 'character_index', 'version_index'):
+        monkeypatch.setattr(zzz, name, getattr(zzz, name))
+    monkeypatch.setattr(zzz, 'buffer_layouts', dict(zzz.buffer_layouts))
+    monkeypatch.setattr(zzz, 'fix_tables', dict(zzz.fix_tables))
+    return zzz.fix_tables
+
+
+def test_plugins_are_only_loaded_for_the_selected_games(zzz, fix_tables, tmp_path):
+    (tmp_path / 'broken.py').write_text('raise Exception("loaded")\n')
+    (tmp_path / 'plugin.py').write_text(PLUGIN)
+    zzz.discover_fix_tables(str(tmp_path))
+    assert fix_tables['broken'].hash_commands is None
+
+    tables = zzz.use_fix_tables(['ZZZ', 'plugin'])
+
+    assert [table.game for table in tables] == ['ZZZ', 'plugin']
+    assert fix_tables['broken'].hash_commands is None
+    assert 'feedf00d' in zzz.hash_commands
+    with pytest.raises(Exception, match='loaded'):
+        zzz.use_fix_tables(['broken'])
+
+
+def test_plugin_conversions_are_converted_one_at_a_time(zzz, fix_tables, tmp_path, monkeypatch):
+    (tmp_path / 'plugin.py').write_text(PLUGIN)
+    XorConversion = zzz.load_fix_table_plugin(str(tmp_path / 'plugin.py'))['XorConversion']
+    assert not zzz.is_picklable([XorConversion(0xff)])
+    assert zzz.is_picklable([zzz.BlendIndicesRemap((1,), (2,))])
+
+    monkeypatch.setattr(zzz, 'buffer_workers', 2)
+    buffers = {'A.buf': bytes(range(8)), 'B.buf': bytes(range(8, 16))}
+    ini = zzz.Ini(None, content='', buffer_provider=buffers.get)
+    for buffer_filename in buffers:
+        ini.queue_buffer_conversion(ini.get_buffer_key(buffer_filename), XorConversion(0xff))
+    ini.convert_buffers()
+
+    assert ini.modified_buffers == {
+        buffer_filename: bytes(byte ^ 0xff for byte in data) for buffer_filename, data in buffers.items()
+    }
@@ -0,0 +1,46 @@
+import re
+
+
+ASTRA_INI = '''[TextureOverrideAstraBody]
+hash = 02d8a2cb
+match_first_index = 0
+ib = ResourceAstraBodyIB
+
+[TextureOverrideAstraMaterial]
+hash = 56abc3a3
+this = ResourceAstraMaterial
+'''
+
+
+def test_hashes_are_handed_out_by_phase_then_in_order(zzz):
+    # IB check, unknown hash, rename, rename
+    queue = zzz.HashQueue(['02d8a2cb', '00000000', '56abc3a3', 'caf95576'])
+
+    assert [queue.pop() for _ in range(len(queue))] == ['00000000', 'caf95576', '56abc3a3', '02d8a2cb']
+
+
+def test_hashes_are_only_handed_out_once(zzz):
+    queue = zzz.HashQueue(['56abc3a3', '56abc3a3'])
+    assert len(queue) == 1
+
+    assert queue.pop() == '56abc3a3'
+    queue.extend(['56abc3a3', '43a4d256'])
+
+    assert '56abc3a3' in queue
+    assert [queue.pop() for _ in range(len(queue))] == ['43a4d256']
+
+
+def test_equivalent_hashes_share_a_class(zzz):
+    queue = zzz.HashQueue(['56abc3a3'])
+
+    assert queue.get_equivalent('43a4d256') == '56abc3a3'
+    assert queue.get_equivalent('02d8a2cb') is None
+
+
+def test_renames_are_done_before_ib_checks(zzz, capsys):
+    ini = zzz.fix_ini_text(ASTRA_INI, lambda filename: None)
+
+    processed = re.findall(r'Processing (\w+):', capsys.readouterr().out)
+    assert processed == ['56abc3a3', '43a4d256', 'fa2f509f', '03df0be9', '02d8a2cb']
+    assert 'hash = fa2f509f' in ini.content
+    assert ini.content.count('run = CommandListSkinTexture') == 1
@@ -0,0 +1,51 @@
+import re
+
+import pytest
+
+
+@pytest.fixture
+def selection(zzz, monkeypatch):
+    # select_hash_commands narrows the tables of the script, they're put back after the test
+    for name in ('hash_commands', 'hash_schedule', 'hash_equivalence', 'known_hashes', 'hash_selection'):
+        monkeypatch.setattr(zzz, name, getattr(zzz, name))
+    return zzz
+
+
+def get_mark_groups(zzz):
+    # {MARK name: {hash, ...}} as laid out in the source of the hash table, a hash listed
+    # twice belongs to the group of its last entry like in the dict
+    marks = {}
+    mark = None
+    with open(zzz.__file__, encoding='utf-8') as f:
+        for line in f:
+            mark_match = re.match(r"^    # MARK: (.+)", line)
+            hash_match = re.match(r"^    '([a-f0-9]{8})':", line)
+            if mark_match:
+                mark = mark_match.group(1).strip()
+            elif hash_match and mark:
+                marks[hash_match.group(1)] = mark
+
+    groups = {}
+    for hash, mark in marks.items():
+        groups.setdefault(mark, set()).add(hash)
+    return groups
+
+
+def test_character_tags_match_the_mark_groups(zzz):
+    for mark, hashes in get_mark_groups(zzz).items():
+        tag = mark.split()[0]
+        assert hashes <= set(zzz.character_index[tag]), mark
+
+
+def test_skins_are_selected_apart_from_their_character(selection):
+    selection.select_hash_commands(['NicoleSkin'])
+    skin = set(selection.hash_commands)
+    assert skin and '6847bbbd' in skin
+
+    selection.select_hash_commands(['nicole'])
+    assert set(selection.hash_commands).isdisjoint(skin)
+
+
+def test_unknown_characters_are_rejected(selection):
+    with pytest.raises(Exception, match='Unknown character'):
+        selection.select_hash_commands(['Nobody'])
@@ -0,0 +1,101 @@
+import io
+import os
+import json
+import time
+import socket
+import threading
+
+import pytest
+
+
+TOKEN = '0123456789abcdef'
+
+
+def request_line(**request):
+    return json.dumps(request).encode('utf-8') + b'\n'
+
+
+@pytest.mark.parametrize('line, error', [
+    (b'POST / HTTP/1.1\r\n', 'Bad request: Expecting value'),
+    (b'[1, 2]\n', 'Bad request: Expected a JSON object'),
+    (request_line(op='ping'), 'Bad request: Missing or wrong token'),
+    (request_line(op='ping', token='fedcba9876543210'), 'Bad request: Missing or wrong token'),
+])
+def test_invalid_requests_are_rejected(zzz, line, error):
+    request, request_error = zzz.parse_request(line, TOKEN)
+    assert request is None
+    assert request_error.startswith(error)
+
+
+def test_request_with_the_token_is_accepted(zzz):
+    request, error = zzz.parse_request(request_line(op='ping', token=TOKEN), TOKEN)
+    assert request == {'op': 'ping', 'token': TOKEN}
+    assert error is None
+
+
+def test_connection_is_closed_on_the_first_invalid_line(zzz):
+    # A JSON line in the body of a plain HTTP POST must never be acted upon
+    rfile = io.BytesIO(
+        b'POST / HTTP/1.1\r\nContent-Type: text/plain\r\n\r\n'
+        + request_line(op='shutdown', token=TOKEN)
+    )
+    wfile = io.BytesIO()
+
+    assert not zzz.serve_connection(rfile, wfile, TOKEN)
+    responses = [json.loads(line) for line in wfile.getvalue().splitlines()]
+    assert len(responses) == 1
+    assert not responses[0]['ok']
+
+
+def test_token_file_replaces_planted_links(zzz, tmp_path):
+    planted = tmp_path / 'planted'
+    planted.write_text('owned by someone else')
+    token_path = tmp_path / 'server.sock.token'
+    token_path.symlink_to(planted)
+
+    zzz.write_private_file(str(token_path), TOKEN)
+
+    assert planted.read_text() == 'owned by someone else'
+    assert not token_path.is_symlink()
+    assert token_path.read_text() == TOKEN
+    assert token_path.stat().st_mode & 0o777 == 0o600
+
+
+def test_server_folder_others_can_access_is_refused(zzz, tmp_path):
+    folder_path = tmp_path / 'zzzfix'
+    folder_path.mkdir()
+    folder_path.chmod(0o777)
+
+    with pytest.raises(Exception, match='only you can access'):
+        zzz.make_private_folder(str(folder_path))
+
+
+@pytest.mark.skipif(not hasattr(socket, 'AF_UNIX'), reason='needs unix sockets')
+def test_served_requests_need_the_token(zzz, tmp_path, monkeypatch):
+    monkeypatch.setenv('XDG_RUNTIME_DIR', str(tmp_path))
+    address = os.path.join(zzz.get_server_folder(), 'server.sock')
+    token_path = zzz.get_server_token_path(address)
+
+    server = threading.Thread(target=zzz.serve, args=(address,), daemon=True)
+    server.start()
+    for _ in range(100):
+        if os.path.exists(token_path):
+            break
+        time.sleep(0.05)
+    token = open(token_path, encoding='utf-8').read()
+    assert os.stat(zzz.get_server_folder()).st_mode & 0o777 == 0o700
+
+    def send(*lines):
+        with socket.socket(socket.AF_UNIX) as client:
+            client.connect(address)
+            client.sendall(b''.join(lines))
+            return [json.loads(line) for line in client.makefile('rb')]
+
+    # Everything after the bad line is dropped along with the connection
+    assert [response['ok'] for response in send(request_line(op='ping', token='wrong'), request_line(op='shutdown', token=token))] == [False]
+    assert [response['ok'] for response in send(request_line(op='ping', token=token), request_line(op='shutdown', token=token))] == [True, True]
+
+    server.join(5)
+    assert not server.is_alive()
+    assert not os.path.exists(token_path)
+    assert not os.path.exists(address)
@@ -0,0 +1,38 @@
+SHARED_BODY = '''ib = ResourceBodyIB
+ps-t0 = ResourceBodyDiffuse
+ps-t1 = ResourceBodyLightMap
+ps-t2 = ResourceBodyNormalMap
+drawindexed = auto
+'''
+
+
+def test_section_settings_stay_in_their_sections(zzz):
+    content = (
+        '[TextureOverrideBodyA]\nhash = 11111111\nmatch_first_index = 0\noverride_byte_stride = 40\noverride_vertex_count = 1000\n' + SHARED_BODY + '\n'
+        '[TextureOverrideBodyB]\nhash = 22222222\nmatch_first_index = 0\noverride_byte_stride = 40\noverride_vertex_count = 2000\n' + SHARED_BODY + '\n'
+    )
+    new_content, shared_count, commandlist_count = zzz.share_section_bodies(content, {'textureoverridebodya'})
+
+    assert (shared_count, commandlist_count) == (2, 1)
+    sections = {
+        header.split(']')[0]: body
+        for header, body in (section.split('\n', 1) for section in new_content.split('\n[')[1:])
+    }
+    commandlist = new_content[new_content.index('[CommandListBodyA]'):new_content.index('[TextureOverrideBodyA]')]
+    assert 'override_' not in commandlist
+    assert 'ps-t0 = ResourceBodyDiffuse' in commandlist
+    assert 'override_vertex_count = 1000' in sections['TextureOverrideBodyA']
+    assert 'override_vertex_count = 2000' in sections['TextureOverrideBodyB']
+    assert 'override_byte_stride = 40' in sections['TextureOverrideBodyB']
+    assert 'run = CommandListBodyA' in sections['TextureOverrideBodyB']
+
+
+def test_texture_settings_are_not_shared(zzz):
+    body = 'format = DXGI_FORMAT_R8G8B8A8_UNORM\nwidth = 2048\nheight = 2048\nstereomode = 2\n' + SHARED_BODY
+    content = '[TextureOverrideA]\nhash = 11111111\n' + body + '\n[TextureOverrideB]\nhash = 22222222\n' + body + '\n'
+    new_content, _, _ = zzz.share_section_bodies(content, {'textureoverridea'})
+
+    commandlist = new_content[new_content.index('[CommandListA]'):new_content.index('[TextureOverrideA]')]
+    for key in ('format', 'width', 'height', 'stereomode'):
+        assert '{} ='.format(key) not in commandlist
+        assert new_content.count('{} ='.format(key)) == 2
@@ -0,0 +1,64 @@
+import struct
+
+from conftest import write_mod
+
+
+CAESAR_HAIR_INI = '''[TextureOverrideCaesarHairTexcoord]
+hash = af291513
+vb1 = ResourceCaesarHairTexcoord
+
+[ResourceCaesarHairTexcoord]
+type = Buffer
+stride = 20
+filename = CaesarHairTexcoord.buf
+'''
+
+
+def fix_caesar_hair(zzz, folder, buffer):
+    mod = write_mod(folder, {'Caesar.ini': CAESAR_HAIR_INI, 'CaesarHairTexcoord.buf': buffer})
+    result = zzz.upgrade_ini(str(mod / 'Caesar.ini'))
+    return result, (mod / 'Caesar.ini').read_text(encoding='utf-8'), (mod / 'CaesarHairTexcoord.buf').read_bytes()
+
+
+def test_declared_layout_is_believed_for_constant_vertices(zzz, tmp_path):
+    # 70 vertices of 20 bytes are also 50 of 28, and constant data fits a lot of layouts
+    buffer = struct.pack('<4B2e2f2e', 0, 0, 0, 0, .5, .5, .25, .25, .5, .5) * 70
+    result, ini, new_buffer = fix_caesar_hair(zzz, tmp_path, buffer)
+
+    assert result
+    assert 'hash = 72537fa3' in ini
+    assert 'stride = 28' in ini
+    assert new_buffer == struct.pack('<4B2f2f2f', 0, 0, 0, 0, .5, .5, .25, .25, .5, .5) * 70
+
+
+def test_ambiguous_buffer_leaves_the_ini_alone(zzz, tmp_path):
+    # Zeros fit the old layout with stride 20 as well as the new one with stride 28
+    buffer = bytes(140)
+    assert len(zzz.infer_texcoord_layout(
+        buffer, zzz.buffer_layouts['texcoord_4B_2e_2f_2e'], zzz.buffer_layouts['texcoord_4B_2f_2f_2f'], 20
+    )) == 2
+
+    result, ini, new_buffer = fix_caesar_hair(zzz, tmp_path, buffer)
+
+    assert not result
+    assert ini == CAESAR_HAIR_INI
+    assert new_buffer == buffer
+
+
+def test_buffer_that_fits_no_layout_leaves_the_ini_alone(zzz, tmp_path):
+    buffer = bytes(range(13))
+    result, ini, new_buffer = fix_caesar_hair(zzz, tmp_path, buffer)
+
+    assert not result
+    assert ini == CAESAR_HAIR_INI
+    assert new_buffer == buffer
+
+
+def test_buffer_already_in_the_new_layout_is_not_remapped_again(zzz, tmp_path):
+    vertices = [(i % 256, 0, 0, 255, i / 100, 1 - i / 100, .5, i / 50, .25, .75) for i in range(1, 71)]
+    buffer = b''.join(struct.pack('<4B2f2f2f', *vertex) for vertex in vertices)
+    result, ini, new_buffer = fix_caesar_hair(zzz, tmp_path, buffer)
+
+    assert result
+    assert 'stride = 28' in ini
+    assert new_buffer == buffer
@@ -0,0 +1,76 @@
+import os
+
+import pytest
+
+from conftest import write_mod
+from test_checkpoint import HAIR_BUFFER, get_hair_ini, read_mods
+
+
+class ScriptedWatcher():
+    # Reports the given batches of changes, then stops the watch like Ctrl+C would
+    name = 'scripted'
+
+    def __init__(self, *batches):
+        self.batches = list(batches)
+
+    def wait(self, timeout):
+        if not self.batches:
+            raise KeyboardInterrupt
+        return self.batches.pop(0)
+
+
+def write_hair_mod(folder):
+    return write_mod(folder, {'Caesar/Caesar.ini': get_hair_ini('Caesar'), 'Caesar/Hair.buf': HAIR_BUFFER})
+
+
+def test_changed_inis_are_fixed_once(zzz, tmp_path, capsys):
+    folder = write_hair_mod(tmp_path / 'mods')
+    ini_path = str(folder / 'Caesar' / 'Caesar.ini')
+    zzz.process_folder(str(write_hair_mod(tmp_path / 'expected')))
+    zzz.global_modified_buffers = {}
+    expected = read_mods(tmp_path / 'expected')
+    capsys.readouterr()
+
+    # The fix writing the ini over is seen as a change too
+    watcher = ScriptedWatcher([ini_path, ini_path], [ini_path], [])
+    with pytest.raises(KeyboardInterrupt), zzz.open_backup_store(str(folder)):
+        zzz.watch_changes(watcher, dry_run=False, debounce=0)
+
+    assert capsys.readouterr().out.count('Found .ini file') == 1
+    assert read_mods(folder) == expected
+
+
+def test_polling_watcher_reports_new_and_modified_inis(zzz, tmp_path):
+    folder = write_hair_mod(tmp_path / 'mods')
+    watcher = zzz.PollingWatcher(str(folder), interval=0)
+    assert watcher.wait(0) == []
+
+    write_mod(folder, {
+        'Lucy/Lucy.ini': get_hair_ini('Lucy'),
+        'Lucy/DISABLED_Lucy.ini': get_hair_ini('Lucy'),
+        '.zzzfix/backups/Lucy.ini': get_hair_ini('Lucy'),
+    })
+    ini_path = folder / 'Caesar' / 'Caesar.ini'
+    ini_path.write_text(get_hair_ini('CaesarAlt'))
+    os.utime(ini_path, ns=(0, 0))
+
+    assert sorted(watcher.wait(0)) == sorted([str(folder / 'Lucy' / 'Lucy.ini'), str(ini_path)])
+    assert watcher.wait(0) == []
+
+
+def test_inotify_watcher_reports_added_mod_folders(zzz, tmp_path):
+    if not zzz.InotifyWatcher.is_available():
+        pytest.skip('inotify is not available')
+
+    watcher = zzz.InotifyWatcher(str(tmp_path))
+    try:
+        write_hair_mod(tmp_path)
+        write_mod(tmp_path, {'Lucy.ini': get_hair_ini('Lucy'), 'DISABLED_Lucy.ini': get_hair_ini('Lucy')})
+
+        changed = set()
+        for _ in range(10):
+            changed.update(watcher.wait(0.1))
+
+        assert changed == {str(tmp_path / 'Caesar' / 'Caesar.ini'), str(tmp_path / 'Lucy.ini')}
+    finally:
+        watcher.close()
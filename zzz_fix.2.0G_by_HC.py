@@ -4,20 +4,77 @@
 # Thanks to Leotorrez, CaveRabbit, and SilentNightSound for help
 # Join AGMG: discord.gg/agmg
 
+import io
 import os
 import re
+import sys
+import json
 import time
+import base64
+import hashlib
+import hmac
+import secrets
+import tempfile
+import codecs
+import socket
+import zipfile
+import posixpath
+import contextlib
+import socketserver
+import ctypes
+import ctypes.util
+import select
+import shutil
+import stat
+import gc
+import tracemalloc
+import heapq
+import bisect
+import functools
 import struct
+import random
 import argparse
+import runpy
+import pickle
+import threading
 import traceback
+import multiprocessing
 
 from dataclasses import dataclass, field
 from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 
 # extra precaution to not 'fix' 
 # the same buffer multiple times
 global_modified_buffers: dict[str, list[str]] = {}
 
+# Worker processes used to convert the buffers of a mod in parallel
+buffer_workers: int = os.cpu_count() or 1
+buffer_pool: ProcessPoolExecutor = None
+
+# Output mode: sections added by the fixes share their body with the sections
+# they were made from through a CommandList, instead of carrying a copy of it
+share_sections: bool = False
+
+# Progress of the current folder run, Ini.convert_buffers reports the buffers it converted
+progress_reporter: 'ProgressReporter' = None
+
+# Counters and timings of the whole run, only collected when they're exported (--metrics)
+run_metrics: 'RunMetrics' = None
+
+# Peak memory per ini (--profile-memory), and the memory (bytes) the
+# process may use before buffer conversions get refused (--memory-budget)
+memory_profiler: 'MemoryProfiler' = None
+memory_budget: int = None
+
+# Store the backups of the current run go to (see open_backup_store), and
+# the number of backups kept per file once a run is over (--keep-backups)
+backup_store: 'BackupStore' = None
+backup_retention: int = None
+
+# Characters and game version the hash table is restricted to (--only, --since), see select_hash_commands
+hash_selection: str = None
+
 
 def main():
     parser = argparse.ArgumentParser(
@@ -26,116 +83,1692 @@ def main():
     )
 
     parser.add_argument('ini_filepath', nargs='?', default=None, type=str)
+    parser.add_argument('-j', '--jobs', type=int, default=None, help='Number of processes used to convert buffers (default: all cores)')
+    parser.add_argument('--watch', action='store_true', help='Keep running and fix .ini files as they are added or modified')
+    parser.add_argument('--resume', action='store_true', help='Continue an interrupted folder run instead of starting over')
+    parser.add_argument('--dry-run', action='store_true', help='Only report what would be fixed, without writing anything')
+    parser.add_argument('--share-sections', action='store_true', help='Move the bodies of added sections that duplicate other sections into shared CommandLists')
+    parser.add_argument('--metrics', default=None, metavar='PATH', help='Write the counters and timings of the run to PATH.prom (OpenMetrics) and PATH.json')
+    parser.add_argument('--profile-memory', action='store_true', help='Report the peak memory and top allocating sites of every .ini file (slow)')
+    parser.add_argument('--benchmark', action='store_true', help='Time the section locators and the bulk edits of the commands on adversarial inis')
+    parser.add_argument('--memory-budget', type=float, default=None, metavar='MB', help='Refuse to convert the buffers of an .ini file when that would take the process over MB megabytes')
+    parser.add_argument('--restore', nargs='?', const='last', default=None, metavar='RUN', help='Roll back the files written by a run (default: the last one) from the backups of the folder. Single .ini files are backed up to the closest folder above them with backups, else to the current folder if they are in it')
+    parser.add_argument('--keep-backups', type=int, default=None, metavar='N', help='Only keep the last N backups of every file')
+    parser.add_argument('--games', default=None, metavar='GAMES', help='Fix tables to apply (comma separated, default: all, see the fix_tables folder next to this script). Only the plugins of these games are loaded')
+    parser.add_argument('--only', default=None, metavar='CHARACTERS', help='Only fix the hashes of these characters (comma separated, e.g. Ellen,Miyabi). Skins are characters of their own (EllenSkin), Jane Doe is Jane')
+    parser.add_argument('--since', default=None, metavar='VERSION', help='Only fix the hashes still in use in this game version or later (e.g. 1.6)')
+    parser.add_argument('--serve', nargs='?', const=DEFAULT_SERVER_ADDRESS, default=None, metavar='ADDRESS',
+                        help='Keep running and accept JSON fix requests carrying the token printed on start (a unix socket path, a \\\\.\\pipe\\ name or HOST:PORT, default: {})'.format(DEFAULT_SERVER_ADDRESS.replace('%', '%%')))
     args = parser.parse_args()
 
-    if args.ini_filepath:
+    global buffer_workers
+    if args.jobs:
+        buffer_workers = max(1, args.jobs)
+
+    global share_sections
+    share_sections = args.share_sections
+
+    global run_metrics
+    if args.metrics:
+        run_metrics = RunMetrics(dry_run=args.dry_run)
+
+    global backup_retention
+    if args.keep_backups is not None:
+        backup_retention = max(1, args.keep_backups)
+
+    global memory_profiler, memory_budget
+    if args.profile_memory:
+        memory_profiler = MemoryProfiler()
+    if args.memory_budget:
+        memory_budget = int(args.memory_budget * 1024**2)
+
+    # Fix tables of other games are plugins in the fix_tables folder next to this script
+    plugin_folder = os.path.join(os.path.dirname(os.path.abspath(sys.argv[0])), 'fix_tables')
+    if os.path.isdir(plugin_folder):
+        discover_fix_tables(plugin_folder)
+    # Without --games every plugin gets loaded, there's no telling which games the mods are for beforehand
+    if args.games or len(fix_tables) > 1:
+        tables = use_fix_tables(args.games.split(',') if args.games else None)
+        print('Fix tables: {}'.format(', '.join('{} ({} hashes)'.format(table.game, len(table.hash_commands)) for table in tables)))
+
+    if args.only or args.since:
+        characters = [character.strip() for character in args.only.split(',') if character.strip()] if args.only else None
+        since = None
+        if args.since:
+            version_match = re.match(r'^\s*(\d+)\.(\d+)\s*$', args.since)
+            if not version_match:
+                raise Exception('--since takes a game version like 1.6')
+            since = (int(version_match.group(1)), int(version_match.group(2)))
+        select_hash_commands(characters, since)
+        print('Hash table: {} of {} hashes ({})'.format(len(hash_commands), len(all_hash_commands), hash_selection))
+
+    if args.benchmark:
+        benchmark_section_locators()
+        print()
+        benchmark_span_edits()
+        print()
+        benchmark_buffer_patches()
+
+    elif args.serve:
+        serve(args.serve)
+
+    elif args.restore:
+        if args.watch or args.resume:
+            raise Exception('--restore can not be combined with --watch or --resume')
+        restore_run(args.ini_filepath or '.', None if args.restore == 'last' else args.restore)
+
+    elif args.ini_filepath:
+        if args.watch or args.resume:
+            raise Exception('--watch and --resume only work on folders')
         if args.ini_filepath.endswith('.ini'):
             print('Passed .ini file:', args.ini_filepath)
-            upgrade_ini(args.ini_filepath)
+            with profile_memory(args.ini_filepath):
+                upgrade_ini(args.ini_filepath, dry_run=args.dry_run)
+        elif args.ini_filepath.lower().endswith('.zip'):
+            print('Passed archive:', args.ini_filepath)
+            process_archive(args.ini_filepath, dry_run=args.dry_run)
         else:
-            raise Exception('Passed file is not an Ini')
+            raise Exception('Passed file is neither an Ini nor a zip archive')
 
     else:
         # Change the CWD to the directory this script is in
         # Nuitka: "Onefile: Finding files" in https://nuitka.net/doc/user-manual.pdf 
         # I'm not using Nuitka anymore but this distinction (probably) also applies for pyinstaller
         # os.chdir(os.path.abspath(os.path.dirname(sys.argv[0])))
+        if args.resume and args.dry_run:
+            raise Exception('--resume can not be combined with --dry-run, dry runs are not checkpointed')
         print('CWD: {}'.format(os.path.abspath('.')))
-        process_folder('.')
+        process_folder('.', dry_run=args.dry_run, resume=args.resume)
+
+        if args.watch:
+            watch_folder('.', dry_run=args.dry_run)
+
+    if buffer_pool is not None:
+        buffer_pool.shutdown()
+
+    if run_metrics:
+        run_metrics.write(args.metrics)
 
     print('Done!')
 
 
 # SHAMELESSLY (mostly) ripped from genshin fix script
-def process_folder(folder_path):
+def process_folder(folder_path, dry_run=False, resume=False):
+    # Returns {ini filepath: whether it was upgraded without errors}
+    with open_backup_store(folder_path):
+        return process_inis(folder_path, dry_run, resume)
+
+
+def process_inis(folder_path, dry_run, resume):
+    # The inis of a folder run, all backed up to the store of the folder
+    results = {}
+    inis = find_inis(folder_path)
+
+    # Progress is checkpointed so that an interrupted run can be resumed
+    checkpoint = None
+    if not dry_run:
+        checkpoint = Checkpoint.start(folder_path, inis, resume)
+        inis = checkpoint.inis
+
+    global progress_reporter
+    progress_reporter = ProgressReporter.for_inis(inis)
+    try:
+        for filepath in inis:
+            progress_reporter.begin(filepath)
+            if checkpoint and checkpoint.is_done(filepath):
+                results[filepath] = checkpoint.get_result(filepath)
+                if run_metrics:
+                    run_metrics.count_ini('skipped')
+            else:
+                print('Found .ini file:', filepath)
+                with profile_memory(filepath):
+                    results[filepath] = upgrade_ini(filepath, dry_run, checkpoint)
+            progress_reporter.end()
+    finally:
+        progress_reporter.finish()
+        progress_reporter = None
+
+    if checkpoint:
+        checkpoint.finish()
+
+    return results
+
+
+def find_inis(folder_path):
+    # All .ini files in the folder and its subfolders, in the order they're processed
+    inis = []
     for filename in os.listdir(folder_path):
-        if filename.upper().startswith('DISABLED') and filename.lower().endswith('.ini'):
-            continue
-        if filename.upper().startswith('DESKTOP'):
+        if is_ignored_filename(filename):
             continue
 
         filepath = os.path.join(folder_path, filename)
         if os.path.isdir(filepath):
-            process_folder(filepath)
+            inis.extend(find_inis(filepath))
         elif filename.endswith('.ini'):
-            print('Found .ini file:', filepath)
-            upgrade_ini(filepath)
+            inis.append(filepath)
+
+    return inis
 
 
-def upgrade_ini(filepath):
+def upgrade_ini(filepath, dry_run=False, checkpoint=None):
+    global global_modified_buffers
+    if dry_run:
+        # Buffers a dry run only pretends to fix must still be fixable later on
+        guarded_buffers = {key: list(fix_ids) for key, fix_ids in global_modified_buffers.items()}
+
     try:
         # Errors occuring here is fine as no write operations to the ini nor any buffers are performed
         ini = Ini(filepath).upgrade()
+        if not dry_run:
+            ini.convert_buffers()
     except Exception as x:
         print('Error occurred: {}'.format(x))
         print('No changes have been applied to {}!'.format(filepath))
         print()
         print(traceback.format_exc())
         print()
+        if checkpoint:
+            checkpoint.commit(filepath, False)
+        if run_metrics:
+            run_metrics.count_ini('failed')
         return False
+    finally:
+        if dry_run:
+            global_modified_buffers = guarded_buffers
+
+    if dry_run:
+        if ini._touched:
+            print('Dry run: {} would be updated along with {} buffer(s)'.format(filepath, len(ini.buffer_conversions)))
+        else:
+            print('Dry run: No changes would be applied')
+        print()
+        if run_metrics:
+            run_metrics.count_ini('fixed' if ini._touched else 'skipped')
+        return True
 
     try:
         # Content of the ini and any modified buffers get written to disk in this function
         # Since the code for this function is more concise and predictable, the chance of it failing
         # is low, but it can happen if Windows doesn't want to cooperate and write for whatever reason.
-        ini.save()
+        timestamp = int(time.time())
+        if checkpoint and ini._touched:
+            checkpoint.begin_save(filepath, timestamp)
+        ini.save(timestamp)
     except Exception as X:
         print('Fatal error occurred while saving changes for {}!'.format(filepath))
         print('Its likely that your mod has been corrupted. You must redownload it from the source before attempting to fix it again.')
         print()
         print(traceback.format_exc())
         print()
+        if run_metrics:
+            run_metrics.count_ini('failed')
         return False
 
+    if checkpoint:
+        checkpoint.commit(filepath, True)
+    if run_metrics:
+        run_metrics.count_ini('fixed' if ini._touched else 'skipped')
     return True
 
 
+def fix_ini_text(ini_text, buffer_provider, dry_run=False, filepath=None, fixed_buffers=None):
+    '''
+    Upgrades a mod without going through the filesystem. `buffer_provider(filename)` gets called
+    with a buffer filename as written in the ini and returns the buffer's data (bytes-like). It's
+    only called for buffers that actually get fixed, once per buffer. Returns the upgraded Ini:
+    `content` holds the new ini text and `modified_buffers` the new data of the fixed buffers,
+    keyed by filename.
+
+    With a (posix) `filepath` for the ini, buffer filenames are resolved relative to it before
+    they're passed to the provider. Inis sharing buffers should share `fixed_buffers` too.
+    '''
+    ini = Ini(filepath, content=ini_text, buffer_provider=buffer_provider, fixed_buffers=fixed_buffers).upgrade()
+    if not dry_run:
+        ini.convert_buffers()
+    return ini
+
+
+def is_ignored_filename(filename):
+    # Backups made by the fix (the folder of its files included) and Windows' desktop.ini files
+    if filename.upper().startswith('DISABLED') and filename.lower().endswith('.ini'):
+        return True
+    if filename == backup_folder_name:
+        return True
+    if filename.upper().startswith('DESKTOP'):
+        return True
+    return False
+
+
+# MARK: Checkpoint
+checkpoint_filename = '.zzzfix_checkpoint.json'
+
+
+@dataclass
+class Checkpoint():
+    '''
+    Progress of a folder run, kept next to the mods until the run is over. Holds the inis
+    found when the run started, the ones that are done (with the digest they were left with),
+    the ini being saved and the fixes applied to buffers by the inis that are done (as
+    global_modified_buffers was when the last one was committed), so that a resumed run never
+    fixes a buffer or ini a second time, and does fix the buffers of an ini it does again.
+    Paths are stored relative to the folder, the run can be resumed after moving it.
+    '''
+    filepath   : str
+    folder_path: str
+    inis       : list[str]
+    committed  : dict[str, dict] = field(default_factory=dict)
+    saving     : dict = None
+    modified_buffers: dict[str, list[str]] = field(default_factory=dict)
+
+    @classmethod
+    def start(cls, folder_path, inis, resume=False):
+        filepath = os.path.join(folder_path, checkpoint_filename)
+        if os.path.exists(filepath):
+            if resume:
+                checkpoint = cls.load(filepath, folder_path)
+                # Inis added since the interrupted run started are done last
+                known_inis = set(checkpoint.inis)
+                checkpoint.inis += [ini for ini in inis if ini not in known_inis]
+                print('Resuming the interrupted run: {} of {} .ini files are done'.format(len(checkpoint.committed), len(checkpoint.inis)))
+                print()
+                return checkpoint
+            print('Found the checkpoint of an interrupted run, starting over (use --resume to continue it)')
+            print()
+        elif resume:
+            print('No interrupted run to resume, starting over')
+            print()
+
+        checkpoint = cls(filepath, folder_path, inis, modified_buffers=get_buffer_fixes())
+        checkpoint.write()
+        return checkpoint
+
+    @classmethod
+    def load(cls, filepath, folder_path):
+        data = json.loads(Path(filepath).read_text(encoding='utf-8'))
+
+        # Inis are stored relative to the folder, buffers too but they're keyed by their absolute path
+        join = lambda ini: os.path.join(folder_path, ini)
+        modified_buffers = {
+            os.path.abspath(join(buffer_key)): fix_ids for buffer_key, fix_ids in data['modified_buffers'].items()
+        }
+        # Copies: the upgrades add to the lists of global_modified_buffers, the checkpoint's only change on commit
+        global_modified_buffers.clear()
+        global_modified_buffers.update({buffer_key: list(fix_ids) for buffer_key, fix_ids in modified_buffers.items()})
+
+        return cls(
+            filepath    = filepath,
+            folder_path = folder_path,
+            inis        = [join(ini) for ini in data['inis']],
+            committed   = {join(ini): entry for ini, entry in data['committed'].items()},
+            saving      = dict(data['saving'], ini=join(data['saving']['ini'])) if data['saving'] else None,
+            modified_buffers = modified_buffers,
+        )
+
+    def write(self):
+        relpath = self.get_relpath
+        data = {
+            'inis'            : [relpath(ini) for ini in self.inis],
+            'committed'       : {relpath(ini): entry for ini, entry in self.committed.items()},
+            'saving'          : dict(self.saving, ini=relpath(self.saving['ini'])) if self.saving else None,
+            'modified_buffers': {relpath(buffer_key): fix_ids for buffer_key, fix_ids in self.modified_buffers.items()},
+        }
+        # Written to the side and swapped in, a checkpoint is either the old or the new one
+        temp_filepath = self.filepath + '.tmp'
+        with open(temp_filepath, 'w', encoding='utf-8') as f:
+            json.dump(data, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_filepath, self.filepath)
+
+    def get_relpath(self, filepath):
+        try:
+            return os.path.relpath(filepath, self.folder_path)
+        except ValueError:
+            # On another drive than the folder, it can only be found where it is
+            return os.path.abspath(filepath)
+
+    def is_done(self, filepath):
+        if self.saving and self.saving['ini'] == filepath:
+            # The ini gets backed up first thing when it's saved: no backup, nothing written yet
+            backup = backup_store.find_backup(filepath, self.saving['timestamp'])
+            if backup is None:
+                return False
+
+            print('Skipping {}: The interrupted run stopped while saving it, its buffers may be partially written!'.format(filepath))
+            print('Roll the interrupted run back with --restore {} (or restore the mod from the source) before fixing it again.'.format(backup['run']))
+            print()
+            self.commit(filepath, False)
+            return True
+
+        entry = self.committed.get(filepath)
+        if entry is None:
+            return False
+        if entry['digest'] != get_file_digest(filepath):
+            print('{} has changed since the interrupted run was done with it'.format(filepath))
+            return False
+
+        print('Skipping {}: Done by the interrupted run'.format(filepath))
+        return True
+
+    def get_result(self, filepath):
+        return self.committed[filepath]['ok']
+
+    def begin_save(self, filepath, timestamp):
+        # The fixes the ini's upgrade added to global_modified_buffers aren't written yet: if the
+        # run stops before the ini is backed up, the resumed run has to fix its buffers again
+        self.saving = {'ini': filepath, 'timestamp': timestamp}
+        self.write()
+
+    def commit(self, filepath, ok):
+        self.committed[filepath] = {'digest': get_file_digest(filepath), 'ok': ok}
+        self.saving = None
+        self.modified_buffers = get_buffer_fixes()
+        self.write()
+
+    def finish(self):
+        os.remove(self.filepath)
+
+
+def get_buffer_fixes():
+    # Copy of global_modified_buffers, which the next upgrades keep adding to
+    return {key: list(fix_ids) for key, fix_ids in global_modified_buffers.items()}
+
+
+def get_file_digest(filepath):
+    try:
+        return hashlib.sha256(Path(filepath).read_bytes()).hexdigest()
+    except OSError:
+        return None
+
+
+# MARK: Backups
+backup_folder_name = '.zzzfix'
+backup_store_path  = os.path.join(backup_folder_name, 'backups')
+
+
+@dataclass
+class BackupStore():
+    '''
+    Backups of the files the fix writes over, kept in <folder>/.zzzfix/backups instead of beside
+    the mods. Every content is stored once, as objects/<sha256[:2]>/<sha256>. index.jsonl has a
+    record per backup: the run that made it, the time, the path of the file (relative to the
+    folder), the kind of backup ('file' for a whole file, 'patch' for the undo patch of a sparsely
+    patched buffer) and the object. Each time the store is opened is a new run.
+    '''
+    folder_path : str
+    run         : int
+    records     : list[dict] = field(default_factory=list)
+
+    @classmethod
+    def open(cls, folder_path):
+        records = []
+        index_path = os.path.join(folder_path, backup_store_path, 'index.jsonl')
+        if os.path.exists(index_path):
+            with open(index_path, encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        records.append(json.loads(line))
+                    except ValueError:
+                        # Cut short by an interrupted run, the file it was for was never written
+                        continue
+
+        # Runs are numbered by the time they started, and always come after the last one
+        last_run = max((record['run'] for record in records), default=0)
+        return cls(folder_path, max(int(time.time()), last_run + 1), records)
+
+    @property
+    def store_path(self):
+        return os.path.join(self.folder_path, backup_store_path)
+
+    def get_object_path(self, digest):
+        return os.path.join(self.store_path, 'objects', digest[:2], digest)
+
+    def get_relpath(self, filepath):
+        return Path(os.path.relpath(filepath, self.folder_path)).as_posix()
+
+    def add(self, filepath, data, kind='file', timestamp=None):
+        # Has to be called before the file gets written over, data being its content (or undo patch)
+        digest = hashlib.sha256(data).hexdigest()
+        object_path = self.get_object_path(digest)
+        if not os.path.exists(object_path):
+            os.makedirs(os.path.dirname(object_path), exist_ok=True)
+            temp_path = object_path + '.tmp'
+            with open(temp_path, 'wb') as f:
+                f.write(data)
+            os.replace(temp_path, object_path)
+
+        record = {
+            'run'   : self.run,
+            'time'  : timestamp or int(time.time()),
+            'path'  : self.get_relpath(filepath),
+            'kind'  : kind,
+            'object': digest,
+        }
+        with open(os.path.join(self.store_path, 'index.jsonl'), 'a', encoding='utf-8') as f:
+            f.write(json.dumps(record) + '\n')
+        self.records.append(record)
+        return record
+
+    def find_backup(self, filepath, timestamp):
+        # Backup of the whole file made when it was saved at timestamp, None if there is none
+        path = self.get_relpath(filepath)
+        return next((
+            record for record in reversed(self.records)
+            if record['path'] == path and record['time'] == timestamp and record['kind'] == 'file'
+        ), None)
+
+    def read_object(self, digest):
+        data = Path(self.get_object_path(digest)).read_bytes()
+        if hashlib.sha256(data).hexdigest() != digest:
+            raise Exception('The backup {} is corrupted'.format(digest))
+        return data
+
+    def get_runs(self):
+        return sorted({record['run'] for record in self.records})
+
+    def prune(self, keep):
+        '''
+        Drops the backups of every file but those of the last `keep` runs that backed it up, along
+        with the objects no backup refers to anymore. Returns the number of objects removed.
+        '''
+        runs = {
+            # path: runs that backed it up, in order
+        }
+        for record in self.records:
+            path_runs = runs.setdefault(record['path'], [])
+            if record['run'] not in path_runs:
+                path_runs.append(record['run'])
+
+        kept = [record for record in self.records if record['run'] in runs[record['path']][-keep:]]
+        if len(kept) == len(self.records):
+            return 0
+
+        # The index is swapped in before any object goes, it never refers to a removed one
+        index_path = os.path.join(self.store_path, 'index.jsonl')
+        temp_path = index_path + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            f.writelines(json.dumps(record) + '\n' for record in kept)
+        os.replace(temp_path, index_path)
+
+        removed = {record['object'] for record in self.records} - {record['object'] for record in kept}
+        for digest in removed:
+            try:
+                os.remove(self.get_object_path(digest))
+            except FileNotFoundError:
+                pass
+        self.records = kept
+        return len(removed)
+
+    def restore(self, run):
+        '''
+        Rolls the files written by a run back to what they were before it. Files are restored in
+        parallel, the backups of each one latest first (a buffer can be patched more than once).
+        Returns {path: whether it was restored}.
+        '''
+        backups = {
+            # path: records of the run, in order
+        }
+        for record in self.records:
+            if record['run'] == run:
+                backups.setdefault(record['path'], []).append(record)
+
+        results = {}
+        with ThreadPoolExecutor(max_workers=buffer_workers) as pool:
+            futures = {pool.submit(self.restore_file, path, records): path for path, records in backups.items()}
+            for future in as_completed(futures):
+                path = futures[future]
+                try:
+                    future.result()
+                    print('Restored: {}'.format(path))
+                    results[path] = True
+                except Exception as x:
+                    print('Failed to restore {}: {}'.format(path, x))
+                    results[path] = False
+
+        return results
+
+    def restore_file(self, path, records):
+        filepath = os.path.join(self.folder_path, *path.split('/'))
+        for record in reversed(records):
+            data = self.read_object(record['object'])
+            if record['kind'] == 'patch':
+                apply_undo_patch(data, filepath)
+            else:
+                temp_filepath = filepath + '.tmp'
+                with open(temp_filepath, 'wb') as f:
+                    f.write(data)
+                os.replace(temp_filepath, filepath)
+
+
+@contextlib.contextmanager
+def open_backup_store(folder_path):
+    # All files saved while the store is open are backed up to it (as a single run),
+    # whatever folder they are in. It's only opened if no run has opened one yet.
+    global backup_store
+    if backup_store is not None:
+        yield backup_store
+        return
+
+    backup_store = BackupStore.open(folder_path)
+    try:
+        yield backup_store
+    finally:
+        store, backup_store = backup_store, None
+        if backup_retention and store.records:
+            removed = store.prune(backup_retention)
+            if removed:
+                print('Removed {} backup(s) past the last {} of their file'.format(removed, backup_retention))
+
+
+def get_backup_folder(dir_path):
+    '''
+    Folder whose store backs up files fixed outside of a folder run, so that restoring from the
+    mods folder finds them: the closest folder above them that already has a store, else the
+    current folder when they are in it, else their own folder.
+    '''
+    dir_path = Path(dir_path).resolve()
+    for folder_path in (dir_path, *dir_path.parents):
+        if (folder_path / backup_store_path).is_dir():
+            return str(folder_path)
+
+    cwd = Path.cwd().resolve()
+    return str(cwd if cwd == dir_path or cwd in dir_path.parents else dir_path)
+
+
+def restore_run(folder_path, run=None):
+    store = BackupStore.open(folder_path)
+    runs = store.get_runs()
+    if not runs:
+        raise Exception('There are no backups in {}'.format(store.store_path))
+    if run is None:
+        run = runs[-1]
+    elif not str(run).isdigit() or int(run) not in runs:
+        raise Exception('There is no run {} in the backups (runs: {})'.format(run, ', '.join(map(str, runs))))
+
+    run = int(run)
+    print('Restoring the files of run {} ({})'.format(run, time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(run))))
+    results = store.restore(run)
+    print('Restored {} of {} file(s)'.format(sum(results.values()), len(results)))
+    return results
+
+
+# MARK: Progress
+@dataclass
+class ProgressReporter():
+    '''
+    Progress of a folder run: inis done out of the ones found, buffer throughput and ETA.
+    Shown as a status line that is redrawn after every ini on a terminal, and as a summary
+    line every `interval` seconds otherwise. The status line is blanked with an ANSI escape
+    where the terminal understands them, with spaces where it doesn't (older Windows
+    consoles). Only called between inis (and once per converted buffer), so the hash
+    processing itself doesn't pay for it.
+    '''
+    total_inis        : int
+    total_buffer_bytes: int
+    stream            : io.TextIOBase = None
+    interval          : float = 10.0
+
+    def __post_init__(self):
+        self.stream       = self.stream or sys.stdout
+        self.tty          = self.stream.isatty()
+        self.ansi         = self.tty and enable_ansi_escapes(self.stream)
+        self.status_width = 0
+        self.started_at   = time.monotonic()
+        self.reported_at  = self.started_at
+        self.done_inis    = 0
+        self.buffer_bytes = 0
+        self.current      = None
+
+    @classmethod
+    def for_inis(cls, inis, **kwargs):
+        return cls(len(inis), get_referenced_buffer_bytes(inis), **kwargs)
+
+    def begin(self, filepath):
+        self.current = filepath
+        if self.tty:
+            # The output of the ini starts where the status line was
+            self.clear_status()
+
+    def end(self):
+        self.done_inis += 1
+        now = time.monotonic()
+        if self.tty:
+            self.clear_status()
+            # Kept to one row, '\r' can't get back to the start of a wrapped line
+            status = self.get_status(now)[:shutil.get_terminal_size().columns - 1]
+            self.stream.write(status)
+            self.stream.flush()
+            self.status_width = len(status)
+        elif now - self.reported_at >= self.interval:
+            self.reported_at = now
+            self.stream.write('Progress: {}\n'.format(self.get_status(now)))
+
+    def add_buffer_bytes(self, size):
+        self.buffer_bytes += size
+
+    def finish(self):
+        elapsed = time.monotonic() - self.started_at
+        if self.tty:
+            self.clear_status()
+        self.stream.write('Processed {} of {} .ini files in {} ({:.1f}/s), converted {} of buffers ({})\n'.format(
+            self.done_inis, self.total_inis, format_duration(elapsed), self.done_inis / max(elapsed, 1e-6),
+            format_size(self.buffer_bytes), format_size(self.buffer_bytes / max(elapsed, 1e-6)) + '/s',
+        ))
+        self.stream.flush()
+
+    def clear_status(self):
+        if self.ansi:
+            self.stream.write('\r\x1b[K')
+        elif self.status_width:
+            self.stream.write('\r' + ' ' * self.status_width + '\r')
+        self.status_width = 0
+
+    def get_status(self, now):
+        elapsed = max(now - self.started_at, 1e-6)
+        eta = elapsed / self.done_inis * (self.total_inis - self.done_inis) if self.done_inis else None
+        return '[{}/{}] {:.1f} files/s, {} of {} referenced buffers converted ({}/s), ETA {} - {}'.format(
+            self.done_inis, self.total_inis, self.done_inis / elapsed,
+            format_size(self.buffer_bytes), format_size(self.total_buffer_bytes), format_size(self.buffer_bytes / elapsed),
+            format_duration(eta) if eta is not None else '?', self.current,
+        )
+
+
+def enable_ansi_escapes(stream):
+    # Windows 10 consoles only handle escapes once asked to, older ones print them as is
+    if sys.platform != 'win32':
+        return True
+
+    ENABLE_VIRTUAL_TERMINAL_PROCESSING = 0x0004
+    try:
+        import msvcrt
+        kernel32 = ctypes.windll.kernel32
+        kernel32.GetConsoleMode.argtypes = (ctypes.c_void_p, ctypes.POINTER(ctypes.c_uint32))
+        kernel32.SetConsoleMode.argtypes = (ctypes.c_void_p, ctypes.c_uint32)
+        handle = msvcrt.get_osfhandle(stream.fileno())
+        mode = ctypes.c_uint32()
+        if not kernel32.GetConsoleMode(handle, ctypes.byref(mode)):
+            return False
+        if mode.value & ENABLE_VIRTUAL_TERMINAL_PROCESSING:
+            return True
+        return bool(kernel32.SetConsoleMode(handle, mode.value | ENABLE_VIRTUAL_TERMINAL_PROCESSING))
+    except (OSError, ValueError, AttributeError):
+        return False
+
+
+def get_referenced_buffer_bytes(inis):
+    # Total size of the buffer files the inis refer to, each file counted once
+    pattern = re.compile(r'^\s*filename\s*=\s*(.*?\.buf)\s*$', flags=re.IGNORECASE|re.MULTILINE)
+    buffer_filepaths = set()
+    for filepath in inis:
+        try:
+            content = decode_ini(Path(filepath).read_bytes())[0]
+        except Exception:
+            continue
+        for buffer_filename in pattern.findall(content):
+            buffer_filepaths.add(os.path.abspath(os.path.join(os.path.dirname(filepath), buffer_filename)))
+
+    return sum(os.path.getsize(filepath) for filepath in buffer_filepaths if os.path.isfile(filepath))
+
+
+def format_size(size):
+    return '{:.1f} MB'.format(size / 1024**2)
+
+
+def format_duration(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return '{}:{:02}:{:02}'.format(hours, minutes, seconds) if hours else '{}:{:02}'.format(minutes, seconds)
+
+
+# MARK: Metrics
+metrics_phases = ('init', 'upgrade', 'buffer_remap', 'save')
+metrics_duration_buckets = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 60.0)
+
+
+@dataclass
+class Histogram():
+    '''
+    Observed values counted by the smallest bucket (upper bound) they fit in,
+    the last count is for the values above all buckets.
+    '''
+    buckets: tuple[float, ...]
+
+    def __post_init__(self):
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum    = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    def get_cumulative_counts(self):
+        # [(upper bound, number of values <= upper bound), ..., ('+Inf', number of values)]
+        cumulative_counts = []
+        total = 0
+        for bound, count in zip([*map(str, self.buckets), '+Inf'], self.counts):
+            total += count
+            cumulative_counts.append((bound, total))
+        return cumulative_counts
+
+
+@dataclass
+class RunMetrics():
+    '''
+    Counters and timings of a run, written once it's over by `write` as an OpenMetrics
+    text file (for e.g. node-exporter's textfile collector) and as JSON. Inis are counted
+    by result: fixed (or would be, in a dry run), skipped (nothing to fix, or done by the
+    interrupted run that was resumed) and failed. Each command that runs for a hash is
+    counted by its class. Phase durations are per ini.
+    '''
+    dry_run: bool = False
+
+    def __post_init__(self):
+        self.started_at   = time.time()
+        self.inis_scanned = 0
+        self.inis         = {'fixed': 0, 'skipped': 0, 'failed': 0}
+        self.hashes       = {'processed': 0, 'skipped': 0}
+        self.commands     = {
+            # command class name: number of times it ran
+        }
+        self.buffer_bytes = {'read': 0, 'written': 0}
+        self.phases       = {phase: Histogram(metrics_duration_buckets) for phase in metrics_phases}
+
+    def count_ini(self, result):
+        self.inis[result] += 1
+
+    def count_command(self, command):
+        self.commands[command] = self.commands.get(command, 0) + 1
+
+    def observe_phase(self, phase, started_at):
+        self.phases[phase].observe(time.perf_counter() - started_at)
+
+    def write(self, path):
+        # PATH.prom and PATH.json, written to the side and swapped in so that
+        # a collector scraping them never reads a partially written file
+        if path.endswith(('.prom', '.json')):
+            path = path[:-5]
+
+        duration = time.time() - self.started_at
+        for filepath, text in ((path + '.prom', self.to_openmetrics(duration)), (path + '.json', json.dumps(self.to_json(duration), indent=4) + '\n')):
+            temp_filepath = filepath + '.tmp'
+            with open(temp_filepath, 'w', encoding='utf-8', newline='\n') as f:
+                f.write(text)
+            os.replace(temp_filepath, filepath)
+        print('Wrote the metrics of the run to {0}.prom and {0}.json'.format(path))
+
+    def to_openmetrics(self, duration):
+        lines = []
+        def add_family(name, type, help, samples, unit=None):
+            lines.append('# TYPE {} {}'.format(name, type))
+            if unit:
+                lines.append('# UNIT {} {}'.format(name, unit))
+            lines.append('# HELP {} {}'.format(name, help))
+            for suffix, labels, value in samples:
+                labels = ','.join('{}="{}"'.format(label, value) for label, value in labels.items())
+                lines.append('{}{}{} {}'.format(name, suffix, '{' + labels + '}' if labels else '', value))
+
+        add_family('zzzfix_inis_scanned', 'counter', 'Ini files read and scanned for hashes.', [
+            ('_total', {}, self.inis_scanned),
+        ])
+        add_family('zzzfix_inis', 'counter', 'Ini files by result of the fix.', [
+            ('_total', {'result': result}, count) for result, count in self.inis.items()
+        ])
+        add_family('zzzfix_hashes', 'counter', 'Hashes found in the inis, by whether there were commands for them.', [
+            ('_total', {'result': result}, count) for result, count in self.hashes.items()
+        ])
+        add_family('zzzfix_commands', 'counter', 'Commands run for the hashes, by command class.', [
+            ('_total', {'command': command}, count) for command, count in sorted(self.commands.items())
+        ])
+        add_family('zzzfix_buffer_bytes', 'counter', 'Bytes of buffers read to be converted and written back.', [
+            ('_total', {'direction': direction}, size) for direction, size in self.buffer_bytes.items()
+        ], unit='bytes')
+        add_family('zzzfix_phase_duration_seconds', 'histogram', 'Time spent per ini in each phase of the fix.', [
+            sample
+            for phase, histogram in self.phases.items()
+            for sample in [
+                *(('_bucket', {'phase': phase, 'le': bound}, count) for bound, count in histogram.get_cumulative_counts()),
+                ('_sum', {'phase': phase}, histogram.sum),
+                ('_count', {'phase': phase}, sum(histogram.counts)),
+            ]
+        ], unit='seconds')
+        add_family('zzzfix_run_duration_seconds', 'gauge', 'Duration of the run.', [
+            ('', {}, duration),
+        ], unit='seconds')
+        add_family('zzzfix_dry_run', 'gauge', 'Whether the run was a dry run.', [
+            ('', {}, int(self.dry_run)),
+        ])
+        lines.append('# EOF')
+        return '\n'.join(lines) + '\n'
+
+    def to_json(self, duration):
+        return {
+            'started_at'      : self.started_at,
+            'duration_seconds': duration,
+            'dry_run'         : self.dry_run,
+            'inis'            : {'scanned': self.inis_scanned, **self.inis},
+            'hashes'          : dict(self.hashes, commands=dict(sorted(self.commands.items()))),
+            'buffer_bytes'    : self.buffer_bytes,
+            'phase_durations' : {
+                phase: {
+                    'count'  : sum(histogram.counts),
+                    'sum'    : histogram.sum,
+                    'buckets': dict(histogram.get_cumulative_counts()),
+                }
+                for phase, histogram in self.phases.items()
+            },
+        }
+
+
+# MARK: Memory
+@dataclass
+class MemoryProfiler():
+    '''
+    Peak memory per ini, traced by tracemalloc for the reading of the ini, Ini.upgrade,
+    the conversion of each buffer and Ini.save, along with the RSS of the process.
+    Once the ini is done, the peaks are reported with the sites that allocated most
+    of what the ini still held after its buffers were converted (or it was upgraded).
+    '''
+    top_sites: int = 3
+
+    def __post_init__(self):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+        self.peaks    = {}
+        self.peak_rss = None
+        self.baseline = None
+        self.held     = None
+
+    @contextlib.contextmanager
+    def profile(self, label):
+        self.peaks    = {
+            # operation: peak traced bytes
+        }
+        self.peak_rss = None
+        self.held     = None
+        self.baseline = tracemalloc.take_snapshot()
+        tracemalloc.reset_peak()
+        try:
+            yield
+        finally:
+            self.report(label)
+
+    def reset_peak(self):
+        tracemalloc.reset_peak()
+
+    def sample(self, operation):
+        # Peak since the last sample (or reset), the traced memory includes everything
+        # the process holds, not only what the operation allocated
+        self.peaks[operation] = max(self.peaks.get(operation, 0), tracemalloc.get_traced_memory()[1])
+        tracemalloc.reset_peak()
+        rss = get_rss()
+        if rss is not None:
+            self.peak_rss = max(self.peak_rss or 0, rss)
+
+    def snapshot_held(self):
+        self.held = tracemalloc.take_snapshot()
+
+    def report(self, label):
+        if not self.peaks:
+            return
+        peak = max(self.peaks.values())
+        print('Memory of {}: peak {} traced ({}){}'.format(
+            label, format_size(peak),
+            ', '.join('{} {}'.format(operation, format_size(size)) for operation, size in self.peaks.items()),
+            ', RSS up to {}'.format(format_size(self.peak_rss)) if self.peak_rss is not None else '',
+        ))
+        if self.held is not None:
+            # What the ini allocated and still held, by the line that allocated it
+            ignored = (tracemalloc.Filter(False, tracemalloc.__file__),)
+            statistics = self.held.filter_traces(ignored).compare_to(self.baseline.filter_traces(ignored), 'lineno')
+            for statistic in [statistic for statistic in statistics if statistic.size_diff > 0][:self.top_sites]:
+                frame = statistic.traceback[0]
+                print('\t{} in {} blocks: {}:{}'.format(format_size(statistic.size_diff), statistic.count_diff, frame.filename, frame.lineno))
+        print()
+
+
+def profile_memory(label):
+    # Reports the peak memory of what runs in the block, if --profile-memory is on
+    return memory_profiler.profile(label) if memory_profiler else contextlib.nullcontext()
+
+
+class ProcessMemoryCounters(ctypes.Structure):
+    # PROCESS_MEMORY_COUNTERS filled by GetProcessMemoryInfo on Windows
+    _fields_ = [('cb', ctypes.c_uint32), ('PageFaultCount', ctypes.c_uint32)] + [
+        (name, ctypes.c_size_t) for name in (
+            'PeakWorkingSetSize', 'WorkingSetSize', 'QuotaPeakPagedPoolUsage', 'QuotaPagedPoolUsage',
+            'QuotaPeakNonPagedPoolUsage', 'QuotaNonPagedPoolUsage', 'PagefileUsage', 'PeakPagefileUsage',
+        )
+    ]
+
+
+def get_rss():
+    # Resident set size of the process in bytes, None where it can't be read
+    if sys.platform.startswith('linux'):
+        try:
+            with open('/proc/self/statm') as f:
+                return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+        except (OSError, ValueError, IndexError):
+            return None
+    if sys.platform == 'win32':
+        kernel32, psapi = ctypes.windll.kernel32, ctypes.windll.psapi
+        kernel32.GetCurrentProcess.restype = ctypes.c_void_p
+        psapi.GetProcessMemoryInfo.argtypes = (ctypes.c_void_p, ctypes.POINTER(ProcessMemoryCounters), ctypes.c_uint32)
+        counters = ProcessMemoryCounters()
+        counters.cb = ctypes.sizeof(counters)
+        if psapi.GetProcessMemoryInfo(kernel32.GetCurrentProcess(), ctypes.byref(counters), counters.cb):
+            return counters.WorkingSetSize
+    return None
+
+
+def get_memory_usage():
+    # What the budget is checked against: the RSS, or the traced memory where the RSS is unknown
+    rss = get_rss()
+    if rss is not None:
+        return rss
+    return tracemalloc.get_traced_memory()[0] if tracemalloc.is_tracing() else 0
+
+
+def reserve_buffer_memory(filepath, buffers, parallel):
+    '''
+    Checks that converting the buffers (paths or data) of an ini fits in the memory budget.
+    Every converted buffer is held along with its original until the ini is saved, and a
+    conversion needs one more copy while it runs (one per buffer in flight when converting in
+    parallel, since the results come back pickled). Falls back to converting one buffer at a
+    time after a garbage collection when that's what it takes, raises when even that won't fit.
+    Returns whether the buffers can still be converted in parallel.
+    '''
+    sizes = [os.path.getsize(buffer) if isinstance(buffer, str) else len(buffer) for buffer in buffers]
+    needed = 2 * sum(sizes) + (sum(sizes) if parallel else max(sizes))
+    if needed <= memory_budget - get_memory_usage():
+        return parallel
+
+    gc.collect()
+    needed = 2 * sum(sizes) + max(sizes)
+    available = memory_budget - get_memory_usage()
+    if needed > available:
+        raise Exception('Converting the buffers of {} needs about {}, but only {} of the memory budget is left'.format(
+            filepath, format_size(needed), format_size(max(available, 0))
+        ))
+    if parallel:
+        print('\tConverting the buffers one at a time to stay within the memory budget')
+    return False
+
+
+# MARK: Watch
+def watch_folder(folder_path, dry_run=False, debounce=2.0):
+    '''
+    Keeps fixing the .ini files that get added to or modified in the folder until interrupted.
+    Changes are debounced so that mods still being extracted/copied are only fixed once they
+    settle. Files whose size and modification time match what the fix itself last saw or wrote
+    are skipped, so backups and rewritten inis don't trigger another round.
+    With dry_run the changes are only reported, like the folder run before it.
+    '''
+    watcher = InotifyWatcher(folder_path) if InotifyWatcher.is_available() else PollingWatcher(folder_path)
+    print('Watching {} for new or modified .ini files ({}). Press Ctrl+C to stop.'.format(os.path.abspath(folder_path), watcher.name))
+    print()
+
+    try:
+        with open_backup_store(folder_path):
+            watch_changes(watcher, dry_run, debounce)
+    except KeyboardInterrupt:
+        print('Stopped watching')
+    finally:
+        watcher.close()
+
+
+def watch_changes(watcher, dry_run, debounce):
+    # ini path: signature of the file after we last processed it
+    processed = {}
+    # ini path: time of the last change seen
+    pending = {}
+
+    while True:
+        for filepath in watcher.wait(timeout=0.5):
+            pending[filepath] = time.monotonic()
+
+        now = time.monotonic()
+        for filepath, changed_at in list(pending.items()):
+            if now - changed_at < debounce:
+                continue
+            del pending[filepath]
+
+            signature = get_file_signature(filepath)
+            if signature is None or processed.get(filepath) == signature:
+                continue
+
+            print('Found .ini file:', filepath)
+            with profile_memory(filepath):
+                upgrade_ini(filepath, dry_run)
+            processed[filepath] = get_file_signature(filepath)
+
+
+def get_file_signature(filepath):
+    try:
+        stat = os.stat(filepath)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+def is_watched_ini(filepath):
+    filename = os.path.basename(filepath)
+    if is_ignored_filename(filename) or not filename.endswith('.ini'):
+        return False
+    return not any(
+        is_ignored_filename(directory)
+        for directory in Path(filepath).parent.parts
+    )
+
+
+class PollingWatcher():
+    name = 'polling'
+
+    def __init__(self, folder_path, interval=2.0):
+        self.folder_path = folder_path
+        self.interval    = interval
+        self.snapshot    = self.scan()
+        self.last_scan   = time.monotonic()
+
+    def scan(self):
+        snapshot = {}
+        for dir_path, dirnames, filenames in os.walk(self.folder_path):
+            dirnames[:] = [dirname for dirname in dirnames if not is_ignored_filename(dirname)]
+            for filename in filenames:
+                filepath = os.path.join(dir_path, filename)
+                if is_watched_ini(filepath):
+                    snapshot[filepath] = get_file_signature(filepath)
+        return snapshot
+
+    def wait(self, timeout):
+        time.sleep(timeout)
+        if time.monotonic() - self.last_scan < self.interval:
+            return []
+
+        snapshot = self.scan()
+        self.last_scan = time.monotonic()
+        changed = [
+            filepath for filepath, signature in snapshot.items()
+            if self.snapshot.get(filepath) != signature
+        ]
+        self.snapshot = snapshot
+        return changed
+
+    def close(self):
+        pass
+
+
+class InotifyWatcher():
+    name = 'inotify'
+
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_TO    = 0x00000080
+    IN_CREATE      = 0x00000100
+    IN_ISDIR       = 0x40000000
+    EVENT_HEADER   = struct.Struct('iIII')
+
+    @staticmethod
+    def is_available():
+        if not sys.platform.startswith('linux'):
+            return False
+        libc_name = ctypes.util.find_library('c')
+        return libc_name is not None and hasattr(ctypes.CDLL(libc_name), 'inotify_init1')
+
+    def __init__(self, folder_path):
+        self.libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self.fd = self.libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+
+        # watch descriptor: watched directory
+        self.directories = {}
+        self.add_directory(folder_path)
+
+    def add_directory(self, dir_path):
+        # inotify isn't recursive, every directory needs its own watch
+        found = []
+        for sub_dir_path, dirnames, filenames in os.walk(dir_path):
+            dirnames[:] = [dirname for dirname in dirnames if not is_ignored_filename(dirname)]
+            mask = self.IN_CLOSE_WRITE | self.IN_MOVED_TO | self.IN_CREATE
+            wd = self.libc.inotify_add_watch(self.fd, os.fsencode(sub_dir_path), mask)
+            if wd >= 0:
+                self.directories[wd] = sub_dir_path
+            # Files that were written before the watch existed
+            found.extend(
+                os.path.join(sub_dir_path, filename) for filename in filenames
+                if is_watched_ini(os.path.join(sub_dir_path, filename))
+            )
+        return found
+
+    def wait(self, timeout):
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return []
+
+        changed = []
+        data = os.read(self.fd, 64 * 1024)
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, name_length = self.EVENT_HEADER.unpack_from(data, offset)
+            offset += self.EVENT_HEADER.size
+            name = os.fsdecode(data[offset:offset + name_length].rstrip(b'\0'))
+            offset += name_length
+
+            if wd not in self.directories or not name:
+                continue
+            filepath = os.path.join(self.directories[wd], name)
+
+            if mask & self.IN_ISDIR:
+                # A whole mod folder got dropped in
+                if not is_ignored_filename(name):
+                    changed.extend(self.add_directory(filepath))
+            elif is_watched_ini(filepath):
+                changed.append(filepath)
+
+        return changed
+
+    def close(self):
+        os.close(self.fd)
+
+
+# MARK: Server
+def get_server_folder():
+    # Folder of the user's own for the socket and the token, the temp folder is shared with other users
+    if os.environ.get('XDG_RUNTIME_DIR'):
+        return os.path.join(os.environ['XDG_RUNTIME_DIR'], 'zzzfix')
+    if os.name == 'nt':
+        return os.path.join(tempfile.gettempdir(), 'zzzfix')
+    return os.path.join(tempfile.gettempdir(), 'zzzfix-{}'.format(os.getuid()))
+
+
+# Not TCP by default: anything on the machine (a web page included) can talk to a local port
+if os.name == 'nt':
+    DEFAULT_SERVER_ADDRESS = '\\\\.\\pipe\\zzzfix'
+else:
+    DEFAULT_SERVER_ADDRESS = os.path.join(get_server_folder(), 'server.sock')
+
+
+def serve(address):
+    '''
+    Resident fix process for mod managers. Accepts newline delimited JSON requests
+    on a local socket and answers each with one JSON line (see `handle_request`).
+    The hash table, compiled patterns and buffer worker pool stay warm between
+    requests. Requests are handled one at a time.
+
+    Every request has to carry the token of this run, which is printed on start and
+    written to a file in a folder only the user can access. A connection is closed on its
+    first line that isn't such a request, so stray data is never acted upon.
+    '''
+    token = secrets.token_hex(16)
+    make_private_folder(get_server_folder())
+
+    tcp_address = re.fullmatch(r'([\w.\-]*|\[[\w:]*\]):(\d+)', address)
+    if address.startswith('\\\\.\\pipe\\'):
+        server = NamedPipeServer(address)
+    elif tcp_address:
+        server = socketserver.TCPServer((tcp_address.group(1).strip('[]'), int(tcp_address.group(2))), FixRequestHandler)
+    elif hasattr(socket, 'AF_UNIX'):
+        if os.path.exists(address):
+            os.remove(address)
+        server = socketserver.UnixStreamServer(address, FixRequestHandler)
+        os.chmod(address, 0o600)
+    else:
+        raise Exception('Unix sockets are not supported here, pass a \\\\.\\pipe\\ name instead')
+    server.token = token
+
+    token_path = get_server_token_path(address)
+    write_private_file(token_path, token)
+
+    print('Serving fix requests on {}. Press Ctrl+C to stop.'.format(address))
+    print('Token: {} (also in {})'.format(token, token_path))
+    with server:
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            print('Stopped serving')
+        finally:
+            os.remove(token_path)
+            if isinstance(server, socketserver.UnixStreamServer):
+                os.remove(address)
+
+
+def get_server_token_path(address):
+    # Tokens only ever go to the server folder, named after the address unless its socket is in there
+    server_folder = get_server_folder()
+    if os.path.dirname(address) == server_folder:
+        return address + '.token'
+    return os.path.join(server_folder, re.sub(r'[^\w.\-]+', '_', address).strip('_') + '.token')
+
+
+def make_private_folder(folder_path):
+    # Another user could have made it first to read what's put in it, or put a link there
+    try:
+        os.mkdir(folder_path, 0o700)
+    except FileExistsError:
+        pass
+
+    info = os.lstat(folder_path)
+    if not stat.S_ISDIR(info.st_mode):
+        raise Exception('{} is not a folder'.format(folder_path))
+    if os.name != 'nt' and (info.st_uid != os.getuid() or info.st_mode & 0o077):
+        raise Exception('{} has to be a folder only you can access'.format(folder_path))
+
+
+def write_private_file(filepath, text):
+    # Whatever is in the way (a file or link planted there) is replaced rather than written through
+    try:
+        os.remove(filepath)
+    except FileNotFoundError:
+        pass
+    fd = os.open(filepath, os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, 'O_NOFOLLOW', 0), 0o600)
+    with open(fd, 'w', encoding='utf-8') as f:
+        f.write(text)
+
+
+class FixRequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        if serve_connection(self.rfile, self.wfile, self.server.token):
+            # shutdown() waits for serve_forever, which is waiting on this handler
+            threading.Thread(target=self.server.shutdown).start()
+
+
+@dataclass
+class NamedPipeServer:
+    '''
+    Windows counterpart of the unix socket server: serves one client at a time on a
+    named pipe that only accepts clients on this machine.
+    '''
+    address: str
+    token: str = None
+
+    PIPE_REJECT_REMOTE_CLIENTS = 0x8
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def serve_forever(self):
+        import _winapi
+        import msvcrt
+
+        while True:
+            handle = _winapi.CreateNamedPipe(
+                self.address,
+                _winapi.PIPE_ACCESS_DUPLEX,
+                _winapi.PIPE_WAIT | self.PIPE_REJECT_REMOTE_CLIENTS,
+                _winapi.PIPE_UNLIMITED_INSTANCES,
+                65536, 65536,
+                _winapi.NMPWAIT_WAIT_FOREVER,
+                _winapi.NULL,
+            )
+            try:
+                _winapi.ConnectNamedPipe(handle, False)
+            except OSError as x:
+                # The client got in between creating the pipe and waiting for it
+                if x.winerror != _winapi.ERROR_PIPE_CONNECTED:
+                    _winapi.CloseHandle(handle)
+                    raise
+
+            fd = msvcrt.open_osfhandle(handle, 0)
+            with open(fd, 'rb') as rfile, open(fd, 'wb', closefd=False) as wfile:
+                try:
+                    shutdown = serve_connection(rfile, wfile, self.token)
+                except BrokenPipeError:
+                    shutdown = False
+            if shutdown:
+                return
+
+
+def serve_connection(rfile, wfile, token):
+    # Returns whether the client asked for a shutdown
+    for line in rfile:
+        if not line.strip():
+            continue
+
+        request, error = parse_request(line, token)
+        if request is None:
+            write_response(wfile, {'ok': False, 'error': error})
+            print('Closed connection: {}'.format(error))
+            return False
+
+        response = handle_request(request)
+        print('{} request: {}'.format(request.get('op'), 'ok' if response['ok'] else response.get('error')))
+        write_response(wfile, response)
+
+        if response.get('shutdown'):
+            return True
+
+    return False
+
+
+def parse_request(line, token):
+    try:
+        request = json.loads(line)
+    except ValueError as x:
+        return None, 'Bad request: {}'.format(x)
+    if not isinstance(request, dict):
+        return None, 'Bad request: Expected a JSON object'
+    if not hmac.compare_digest(str(request.get('token', '')).encode('utf-8'), token.encode('utf-8')):
+        return None, 'Bad request: Missing or wrong token'
+    return request, None
+
+
+def write_response(wfile, response):
+    wfile.write(json.dumps(response).encode('utf-8') + b'\n')
+    wfile.flush()
+
+
+def handle_request(request):
+    '''
+    {"op": "ping"}
+    {"op": "fix", "path": <ini file, folder or zip archive>, "dry_run": false}
+        -> {"ok", "results": {<ini filepath>: <bool>}, "log"}
+    {"op": "fix_text", "ini": <ini text>, "buffers": {<filename>: <base64>}, "dry_run": false}
+        -> {"ok", "touched", "ini": <new ini text>, "buffers": {<filename>: <base64 of modified buffer>}, "log"}
+    {"op": "shutdown"}
+
+    Every request also carries the token of the server run: {"op": ..., "token": <token>, ...}
+    Every request is its own run: buffers fixed by an earlier request can be fixed again.
+    '''
+    global global_modified_buffers
+    global_modified_buffers = {}
+
+    op = request.get('op')
+    dry_run = bool(request.get('dry_run', False))
+    log_output = io.StringIO()
+    try:
+        with contextlib.redirect_stdout(log_output):
+            if op == 'ping':
+                response = {}
+            elif op == 'shutdown':
+                response = {'shutdown': True}
+            elif op == 'fix':
+                response = fix_path_request(request['path'], dry_run)
+            elif op == 'fix_text':
+                response = fix_text_request(request['ini'], request.get('buffers', {}), dry_run)
+            else:
+                raise Exception('Unknown op: {}'.format(op))
+    except Exception as x:
+        return {'ok': False, 'error': str(x), 'log': log_output.getvalue()}
+
+    return {'ok': True, **response, 'log': log_output.getvalue()}
+
+
+def fix_path_request(path, dry_run):
+    if os.path.isdir(path):
+        return {'results': process_folder(path, dry_run)}
+    if path.endswith('.ini') and os.path.isfile(path):
+        return {'results': {path: upgrade_ini(path, dry_run)}}
+    if path.lower().endswith('.zip') and os.path.isfile(path):
+        return {'results': process_archive(path, dry_run)}
+    raise Exception('{} is neither a folder, an .ini file nor a zip archive'.format(path))
+
+
+def fix_text_request(ini_text, buffers, dry_run):
+    # Buffers are only decoded once the fixes ask for them
+    buffers = {buffer_filename.replace('\\', '/'): data for buffer_filename, data in buffers.items()}
+    def buffer_provider(buffer_filename):
+        data = buffers.get(buffer_filename.replace('\\', '/'))
+        if data is None:
+            raise Exception('Missing buffer: {}'.format(buffer_filename))
+        return base64.b64decode(data)
+
+    ini = fix_ini_text(ini_text, buffer_provider, dry_run)
+    if dry_run:
+        return {'touched': ini._touched}
+
+    return {
+        'touched': ini._touched,
+        'ini': ini.content,
+        'buffers': {
+            buffer_filename: base64.b64encode(data).decode('ascii')
+            for buffer_filename, data in ini.modified_buffers.items()
+        },
+    }
+
+
+# MARK: Archive
+def process_archive(archive_path, dry_run=False, output_path=None):
+    '''
+    Fixes the mods in a zip archive without extracting it. The inis and the buffers they refer
+    to are read from the archive and upgraded in memory, then a new archive is written next to
+    the original one (<name>.fixed.zip). Untouched members are copied over as their raw
+    compressed bytes, only the changed inis and buffers get compressed again.
+    '''
+    # Returns {ini member: whether it was upgraded without errors}
+    results = {}
+    changed = {
+        # member filename: new data
+    }
+    # All inis of the archive see the same buffers, like the inis of a folder
+    fixed_buffers = {}
+
+    with zipfile.ZipFile(archive_path) as archive:
+        # Mods aren't picky about the case of their filenames (Windows isn't either)
+        members = {info.filename.lower(): info for info in archive.infolist() if not info.is_dir()}
+
+        def buffer_provider(buffer_key):
+            info = members.get(buffer_key.lower())
+            if info is None:
+                return None
+            # A buffer another ini of the archive already fixed is fixed further
+            if info.filename in changed:
+                return changed[info.filename]
+            return archive.read(info)
+
+        for info in archive.infolist():
+            if info.is_dir() or not info.filename.endswith('.ini') or is_ignored_filename(posixpath.basename(info.filename)):
+                continue
+
+            print('Found .ini file:', info.filename)
+            data = archive.read(info)
+            try:
+                content, encoding, bom = decode_ini(data)
+                with profile_memory(info.filename):
+                    ini = fix_ini_text(content, buffer_provider, dry_run, filepath=info.filename, fixed_buffers=fixed_buffers)
+            except Exception as x:
+                print('Error occurred: {}'.format(x))
+                print('No changes have been applied to {}!'.format(info.filename))
+                print()
+                print(traceback.format_exc())
+                print()
+                results[info.filename] = False
+                if run_metrics:
+                    run_metrics.count_ini('failed')
+                continue
+
+            results[info.filename] = True
+            if run_metrics:
+                run_metrics.count_ini('fixed' if ini._touched else 'skipped')
+            if not ini._touched:
+                print('No changes applied')
+            elif dry_run:
+                print('Dry run: {} would be updated along with {} buffer(s)'.format(info.filename, len(ini.buffer_conversions)))
+            else:
+                newline = '\r\n' if '\r\n'.encode(encoding) in data else '\n'
+                changed[info.filename] = (('\ufeff' if bom else '') + ini.content.replace('\n', newline)).encode(encoding)
+                for buffer_key, buffer in ini.modified_buffers.items():
+                    if buffer != ini.original_buffers.get(buffer_key):
+                        changed[members[buffer_key.lower()].filename] = buffer
+                        if run_metrics:
+                            run_metrics.buffer_bytes['written'] += len(buffer)
+                print('Updates applied')
+            print()
+
+        if changed:
+            if output_path is None:
+                output_path = os.path.splitext(archive_path)[0] + '.fixed.zip'
+            write_archive(archive, archive_path, output_path, changed)
+            print('Saved {} changed member(s) to {}'.format(len(changed), output_path))
+            print()
+
+    return results
+
+
+def write_archive(archive, archive_path, output_path, changed):
+    # Every local record (header, compressed data and data descriptor if any)
+    # ends where the next one or the central directory starts
+    records = sorted(archive.infolist(), key=lambda info: info.header_offset)
+    record_ends = {
+        id(info): next_info.header_offset if next_info else archive.start_dir
+        for info, next_info in zip(records, records[1:] + [None])
+    }
+
+    temp_path = output_path + '.tmp'
+    with open(archive_path, 'rb') as src, open(temp_path, 'wb') as dst, zipfile.ZipFile(dst, 'w') as output:
+        for info in archive.infolist():
+            if info.filename in changed:
+                new_info = zipfile.ZipInfo(info.filename, info.date_time)
+                new_info.compress_type = info.compress_type
+                new_info.external_attr = info.external_attr
+                output.writestr(new_info, changed[info.filename])
+                continue
+
+            src.seek(info.header_offset)
+            size = record_ends[id(info)] - info.header_offset
+            info.header_offset = dst.tell()
+            while size > 0:
+                chunk = src.read(min(size, 1 << 20))
+                if not chunk:
+                    raise Exception('{} is truncated'.format(archive_path))
+                dst.write(chunk)
+                size -= len(chunk)
+            output.filelist.append(info)
+            output.NameToInfo[info.filename] = info
+            # zipfile writes the next member and the central directory at start_dir
+            output.start_dir = dst.tell()
+
+    os.replace(temp_path, output_path)
+
+
 # MARK: Ini
+# Inis starting with a BOM are decoded as the encoding it stands for
+ini_boms = (
+    (codecs.BOM_UTF8,     'utf-8'),
+    (codecs.BOM_UTF16_LE, 'utf-16-le'),
+    (codecs.BOM_UTF16_BE, 'utf-16-be'),
+)
+# Otherwise the first of these the ini is valid in. Shift-JIS (cp932) comes after gb2312,
+# since Japanese text is hardly ever valid gb2312 (kana lead bytes are out of its range)
+ini_encodings = ('utf-8', 'gb2312', 'cp932')
+
+
+def decode_ini(data):
+    '''
+    Decodes the raw bytes of an ini. Returns (content, encoding, bom) where bom tells if the
+    data started with a BOM. Line endings are normalised like a text mode read would.
+    '''
+    for bom, encoding in ini_boms:
+        if data.startswith(bom):
+            content = data[len(bom):].decode(encoding)
+            break
+    else:
+        bom = None
+        for encoding in ini_encodings:
+            try:
+                # The decoders bail out at the first invalid byte
+                content = data.decode(encoding)
+                break
+            except UnicodeDecodeError:
+                continue
+        else:
+            raise Exception('Unable to detect the encoding of the ini (tried BOM, {})'.format(', '.join(ini_encodings)))
+
+    return content.replace('\r\n', '\n').replace('\r', '\n'), encoding, bom is not None
+
+
 class Ini():
-    def __init__(self, filepath):
+    def __init__(self, filepath, content=None, buffer_provider=None, fixed_buffers=None):
+        started_at = time.perf_counter()
         self.filepath = filepath
-        try:
-            self.content  = Path(self.filepath).read_text(encoding='utf-8')
+        if content is not None:
+            self.content  = content
             self.encoding = 'utf-8'
-        except UnicodeDecodeError:
-            self.content  = Path(self.filepath).read_text(encoding='gb2312')
-            self.encoding = 'gb2312'
-        
+            self.bom      = False
+        else:
+            # Read once, the encoding (and BOM) is kept for save()
+            self.content, self.encoding, self.bom = decode_ini(Path(self.filepath).read_bytes())
+
+        # In-memory inis get their buffers from the provider instead of the disk
+        self.buffer_provider = buffer_provider
+        self.provided_buffers = {
+            # buffer_filename: buffer_data
+        }
+        # Fixes applied to each buffer. Buffers on disk can be shared by several inis,
+        # so they're tracked across the whole run, in-memory buffers only for this ini.
+        if fixed_buffers is None:
+            fixed_buffers = global_modified_buffers if buffer_provider is None else {}
+        self.fixed_buffers = fixed_buffers
 
-        # The random ordering of sets is annoying
-        # Use a list for the hashes that will be iterated on
-        # and a set for the hashes I already iterated on
-        self._hashes = []
         self._touched = False
-        self._done_hashes = set()
+        # Titles of the sections added by the fixes (lowercase), see share_section_bodies
+        self.added_sections = set()
 
-        # Only write the modified buffers at the very end after the ini is saved, since
-        # the ini can be backed up, while backing up buffers is not not reasonable.
-        # Buffer with multiple fixes: will be read from the mod directory for the first
-        # fix, and from this dict in memory for subsequent fixes 
+        # Only write the modified buffers at the very end after the ini is saved, each
+        # backed up to the store of the run first (as an undo patch when sparsely patched)
         self.modified_buffers = {
             # buffer_filepath: buffer_data
         }
+        # Buffers as they were read from disk, kept around so that same sized
+        # modifications can be written back as a sparse patch in save()
+        self.original_buffers = {
+            # buffer_filepath: buffer_data
+        }
+        # Buffer conversions are only queued by the commands while the ini is being
+        # upgraded, and run all at once (in parallel across buffers) by convert_buffers
+        self.buffer_conversions = {
+            # buffer_filepath: [conversion, ...]
+        }
 
-        # Get all (uncommented) hashes in the ini
-        pattern = re.compile(r'\n\s*hash\s*=\s*([a-f0-9]*)', flags=re.IGNORECASE)
-        self._hashes = pattern.findall(self.content)
+        # Get all (uncommented) hashes in the ini, along with where the known ones are
+        hashes, self._occurrences, self._section_starts = scan_hashes(self.content)
+        self._scanned_content  = self.content
+        self._compared_content = self.content
+        self._first_change     = len(self.content)
+        self._hashes = HashQueue(hashes)
+
+        if run_metrics:
+            run_metrics.inis_scanned += 1
+            run_metrics.observe_phase('init', started_at)
+        if memory_profiler:
+            memory_profiler.sample('read')
     
     def upgrade(self):
+        started_at = time.perf_counter()
+        if memory_profiler:
+            memory_profiler.reset_peak()
+        if hash_selection and not self._occurrences:
+            # None of the selected hashes (or the ones their commands refer to) are in the ini,
+            # so it's for characters or versions that were left out of the run
+            print(f'\tSkipping all hashes: None of them are from {hash_selection}')
+            self._hashes = HashQueue()
         while len(self._hashes) > 0:
             hash = self._hashes.pop()
-            if hash not in self._done_hashes:
-                if hash in hash_commands:
-                    print(f'\tProcessing {hash}:')
-                    default_args = DefaultArgs(hash=hash, ini=self, data={}, tabs=2)
-                    self.execute(hash_commands[hash], default_args)
-                else:
-                    print(f'\tSkipping {hash}: No tasks available')
+            if hash in hash_commands:
+                print(f'\tProcessing {hash}:')
+                default_args = DefaultArgs(hash=hash, ini=self, data={}, tabs=2)
+                self.execute(hash_commands[hash], default_args)
+                if run_metrics:
+                    run_metrics.hashes['processed'] += 1
             else:
-                print(f'\tSkipping {hash}: Already Checked/Processed')
-
-            self._done_hashes.add(hash)
-
+                print(f'\tSkipping {hash}: No tasks available')
+                if run_metrics:
+                    run_metrics.hashes['skipped'] += 1
+
+        if share_sections and self.added_sections:
+            size = len(self.content)
+            self.content, shared_count, commandlist_count = share_section_bodies(self.content, self.added_sections)
+            if commandlist_count:
+                print('\tShared the bodies of {} sections through {} CommandList(s): {} -> {} characters ({:+.1f}%)'.format(
+                    shared_count, commandlist_count, size, len(self.content), (len(self.content) - size) / size * 100
+                ))
+
+        if run_metrics:
+            run_metrics.observe_phase('upgrade', started_at)
+        if memory_profiler:
+            memory_profiler.sample('upgrade')
+            memory_profiler.snapshot_held()
         return self
 
     def execute(self, commands, default_args):
@@ -144,6 +1777,8 @@ class Ini():
             args = command[1] if len(command) > 1 else {}
             instance = clss(**args) if type(args) is dict else clss(*args) 
             result: ExecutionResult = instance.execute(default_args)
+            if run_metrics:
+                run_metrics.count_command(clss.__name__)
 
             self._touched = self._touched or result.touched
             if result.failed:
@@ -151,8 +1786,8 @@ class Ini():
                 return
 
             if result.queue_hashes:
-                # Only add the hashes that I haven't already iterated on
-                self._hashes.extend(set(result.queue_hashes).difference(self._done_hashes))
+                # The queue drops the hashes that are already pending or done
+                self._hashes.extend(result.queue_hashes)
 
             if result.queue_commands:
                 # sub_default_args = DefaultArgs(
@@ -163,42 +1798,614 @@ class Ini():
                 # )
                 self.execute(result.queue_commands, default_args)
 
-            if result.signal_break:
-                return
+            if result.signal_break:
+                return
+
+        return default_args
+
+    def save(self, timestamp=None):
+        if self.buffer_provider is not None:
+            raise Exception('In-memory inis can not be saved')
+        started_at = time.perf_counter()
+        if memory_profiler:
+            memory_profiler.reset_peak()
+        if self._touched:
+            timestamp = timestamp or int(time.time())
+            basename = os.path.basename(self.filepath).split('.ini')[0]
+            dir_path = os.path.abspath(self.filepath.split(basename+'.ini')[0])
+            # A single ini without a run around it goes to the store of the folder it belongs to
+            with open_backup_store(get_backup_folder(dir_path)) as store:
+                self.save_with_backups(store, timestamp)
+
+            print('Updates applied')
+        else:
+            print('No changes applied')
+        print()
+
+        if run_metrics:
+            run_metrics.observe_phase('save', started_at)
+        if memory_profiler:
+            memory_profiler.sample('save')
+
+    def save_with_backups(self, store, timestamp):
+        # Everything gets backed up before it's written over
+        store.add(self.filepath, Path(self.filepath).read_bytes(), timestamp=timestamp)
+        print('Created Backup: {} in {}'.format(store.get_relpath(self.filepath), store.store_path))
+        with open(self.filepath, 'w', encoding=self.encoding) as updated_ini:
+            if self.bom:
+                updated_ini.write('\ufeff')
+            updated_ini.write(self.content)
+        # with open('DISABLED_BACKUP_debug.ini', 'w', encoding='utf-8') as updated_ini:
+        #     updated_ini.write(self.content)
+
+        if len(self.modified_buffers) > 0:
+            print('Writing updated buffers')
+            for filepath, data in self.modified_buffers.items():
+                # Same sized buffers (remaps that keep the stride) only get
+                # the changed byte ranges written back to the existing file
+                patch = None
+                if filepath in self.original_buffers:
+                    patch = BufferPatch.diff(self.original_buffers[filepath], data)
+
+                if patch and not patch.ranges:
+                    print('\tUnchanged: {}'.format(filepath))
+                elif patch and patch.is_sparse():
+                    store.add(filepath, patch.get_undo_patch(self.original_buffers[filepath]), kind='patch', timestamp=timestamp)
+                    patch.apply(filepath, data)
+                    print('\tPatched: {} ({} bytes in {} range(s))'.format(filepath, patch.patched_bytes(), len(patch.ranges)))
+                    if run_metrics:
+                        run_metrics.buffer_bytes['written'] += patch.patched_bytes()
+                else:
+                    original = self.original_buffers.get(filepath)
+                    if original is None and os.path.exists(filepath):
+                        original = Path(filepath).read_bytes()
+                    if original is not None:
+                        store.add(filepath, original, timestamp=timestamp)
+                    with open(filepath, 'wb') as f:
+                        f.write(data)
+                    print('\tSaved: {}'.format(filepath))
+                    if run_metrics:
+                        run_metrics.buffer_bytes['written'] += len(data)
+
+    def has_hash(self, hash):
+        return hash in self._hashes
+
+    def get_hash_occurrences(self):
+        # {known hash: [HashOccurrence, ...]} for the current content,
+        # only scanned again once the content has changed
+        if self._scanned_content is not self.content:
+            _, self._occurrences, self._section_starts = scan_hashes(self.content)
+            self._scanned_content = self.content
+        return self._occurrences
+
+    def get_hash_section_start(self, hash):
+        # Searches with get_section_hash_pattern(hash) can't match before the first section
+        # with the hash, so they can start there instead of at the start of the content
+        hash = hash.lower()
+        if hash not in known_hashes:
+            return 0
+
+        occurrences = self._occurrences.get(hash)
+        start = occurrences[0].section_start if occurrences else len(self._scanned_content)
+        if self._scanned_content is self.content:
+            return start
+
+        # Scanning again costs more than a search. The last scan still holds up to the line
+        # of the first edit since then, and a match starting before that line would have to
+        # start at the last section header before it.
+        line_start = self.content.rfind('\n', 0, self._get_first_change()) + 1
+        i = bisect.bisect_left(self._section_starts, line_start)
+        return min(start, self._section_starts[i - 1] if i else 0)
+
+    def _get_first_change(self):
+        if self._compared_content is not self.content:
+            self._first_change     = find_first_change(self._scanned_content, self.content)
+            self._compared_content = self.content
+        return self._first_change
+
+    def get_equivalent_hash(self, hash):
+        # The hash of the ini that is equivalent to this one (or is this one), None if there is none
+        return self._hashes.get_equivalent(hash)
+
+    def get_buffer_key(self, buffer_filename):
+        # Buffers on disk are keyed by their absolute path, in-memory buffers by
+        # their filename, relative to the ini's path if it has one
+        if self.buffer_provider is not None:
+            if self.filepath is None:
+                return buffer_filename
+            return posixpath.normpath(posixpath.join(posixpath.dirname(self.filepath), buffer_filename.replace('\\', '/')))
+        # Normalized, the checkpoint of a run stores them relative to its folder and back
+        return os.path.abspath(os.path.join(os.path.dirname(self.filepath), buffer_filename))
+
+    def get_buffer_source(self, buffer_key):
+        # What convert_buffer and infer_texcoord_layout read the buffer from:
+        # the path of a buffer on disk, or the data of an in-memory buffer
+        if self.buffer_provider is None:
+            return buffer_key
+        if buffer_key not in self.provided_buffers:
+            data = self.buffer_provider(buffer_key)
+            if data is None:
+                raise Exception('Missing buffer: {}'.format(buffer_key))
+            # Has to be picklable for the worker processes
+            self.provided_buffers[buffer_key] = data if isinstance(data, (bytes, bytearray)) else bytes(data)
+        return self.provided_buffers[buffer_key]
+
+    def queue_buffer_conversion(self, buffer_filepath, conversion):
+        # Buffer with multiple fixes: conversions are applied in the order they're queued
+        if buffer_filepath not in self.buffer_conversions:
+            self.buffer_conversions[buffer_filepath] = []
+        self.buffer_conversions[buffer_filepath].append(conversion)
+
+    def convert_buffers(self):
+        # Every buffer is an independent job, so buffers are converted
+        # in parallel when there's more than one of them
+        started_at = time.perf_counter()
+        jobs = [
+            (self.get_buffer_source(buffer_key), conversions)
+            for buffer_key, conversions in self.buffer_conversions.items()
+        ]
+        parallel = len(jobs) > 1 and buffer_workers > 1
+        if parallel and not all(is_picklable(conversions) for _, conversions in jobs):
+            print('\tConverting the buffers one at a time: Some conversions of a fix table plugin can\'t be sent to the worker processes')
+            parallel = False
+        if memory_budget is not None and jobs:
+            parallel = reserve_buffer_memory(self.filepath, [buffer for buffer, _ in jobs], parallel)
+
+        if memory_profiler:
+            memory_profiler.reset_peak()
+        if parallel:
+            print(f'\tConverting {len(jobs)} buffers in parallel')
+            results = get_buffer_pool().map(convert_buffer, *zip(*jobs))
+        else:
+            results = (convert_buffer(*job) for job in jobs)
+
+        for buffer_key, (original, buffer) in zip(self.buffer_conversions, results):
+            self.original_buffers[buffer_key] = original
+            self.modified_buffers[buffer_key] = buffer
+            if progress_reporter:
+                progress_reporter.add_buffer_bytes(len(original))
+            if run_metrics:
+                run_metrics.buffer_bytes['read'] += len(original)
+            if memory_profiler:
+                # Serial conversions run as the results are consumed, so this is the peak of one buffer
+                memory_profiler.sample(posixpath.basename(buffer_key.replace('\\', '/')))
+
+        if run_metrics:
+            run_metrics.observe_phase('buffer_remap', started_at)
+        if memory_profiler and jobs:
+            memory_profiler.snapshot_held()
+
+
+class HashQueue():
+    '''
+    Work queue for the hashes of an ini. Hashes are handed out by their schedule key
+    (see `get_hash_schedule_key`) so that e.g. all hash renames are done before any
+    IB checks get added, and in the order they were queued otherwise. A hash is only
+    ever handed out once: queueing a hash that is pending or done is a no-op.
+    Also keeps track of the equivalence classes (see `get_hash_class`) present in the ini.
+    '''
+
+    def __init__(self, hashes=()):
+        self._heap    = []
+        self._pending = set()
+        self._done    = set()
+        self._classes = {
+            # hash class: first hash of the class that was queued
+        }
+        self._count   = 0
+        self.extend(hashes)
+
+    def extend(self, hashes):
+        for hash in hashes:
+            if hash in self._pending or hash in self._done:
+                continue
+            self._pending.add(hash)
+            self._classes.setdefault(get_hash_class(hash), hash)
+            heapq.heappush(self._heap, (get_hash_schedule_key(hash), self._count, hash))
+            self._count += 1
+
+    def pop(self):
+        # The popped hash counts as done right away so that
+        # its own commands can't queue it a second time
+        _, _, hash = heapq.heappop(self._heap)
+        self._pending.remove(hash)
+        self._done.add(hash)
+        return hash
+
+    def __len__(self):
+        return len(self._heap)
+
+    def __contains__(self, hash):
+        return hash in self._pending or hash in self._done
+
+    def get_equivalent(self, hash):
+        return self._classes.get(get_hash_class(hash))
+
+
+# MARK: Buffers
+@dataclass
+class BufferPatch():
+    '''
+    Sparse difference between two buffers of the same size. Only the byte ranges that
+    differ get written to the existing buffer file, and the original bytes of those
+    ranges are backed up as an undo patch so the change can be undone with
+    `apply_undo_patch`.
+    '''
+    size   : int
+    ranges : list[tuple[int, int]] # = [(start, end), ...]
+
+    MAGIC        = b'ZZZP'
+    COARSE_BLOCK = 1 << 16
+    # Bytes the undo patch spends on every range
+    RANGE_HEADER = struct.calcsize('<QI')
+    # Changed bytes separated by no more unchanged bytes than a range header costs
+    changed_pattern = re.compile(rb'[^\x00](?:\x00{0,%d}[^\x00])*' % RANGE_HEADER)
+
+    @classmethod
+    def diff(cls, old, new):
+        if len(old) != len(new):
+            return None
+
+        old = memoryview(old)
+        new = memoryview(new)
+        size   = len(new)
+        ranges = []
+
+        # Skip over large identical chunks first, then find the bytes that changed
+        # in the others (a blend remap only changes a few index bytes per vertex)
+        for i in range(0, size, cls.COARSE_BLOCK):
+            coarse_end = min(i + cls.COARSE_BLOCK, size)
+            if old[i:coarse_end] == new[i:coarse_end]:
+                continue
+
+            # Changed bytes are the ones that don't xor to zero
+            changed = (
+                int.from_bytes(old[i:coarse_end], 'little') ^ int.from_bytes(new[i:coarse_end], 'little')
+            ).to_bytes(coarse_end - i, 'little')
+            for changed_match in cls.changed_pattern.finditer(changed):
+                start, end = i + changed_match.start(), i + changed_match.end()
+                if ranges and start - ranges[-1][1] <= cls.RANGE_HEADER:
+                    ranges[-1] = (ranges[-1][0], end)
+                else:
+                    ranges.append((start, end))
+
+        return cls(size, ranges)
+
+    def patched_bytes(self):
+        return sum(end - start for start, end in self.ranges)
+
+    def get_undo_patch_size(self):
+        return 4 + self.RANGE_HEADER * (len(self.ranges) + 1) + self.patched_bytes()
+
+    def is_sparse(self):
+        # Past this point rewriting the whole buffer is cheaper
+        # than seeking around it and keeping an undo patch
+        return self.get_undo_patch_size() <= self.size // 2
+
+    def apply(self, filepath, data):
+        data = memoryview(data)
+        with open(filepath, 'r+b') as f:
+            for start, end in self.ranges:
+                f.seek(start)
+                f.write(data[start:end])
+
+    def get_undo_patch(self, original):
+        original = memoryview(original)
+        parts = [self.MAGIC, struct.pack('<QI', self.size, len(self.ranges))]
+        for start, end in self.ranges:
+            parts.append(struct.pack('<QI', start, end - start))
+            parts.append(original[start:end])
+        return b''.join(parts)
+
+
+@dataclass(frozen=True)
+class BufferElement():
+    name   : str # = 'COLOR', 'TEXCOORD', 'BLENDINDICES', ...
+    format : str # = struct format character, 'B', 'e', 'f', 'I', ...
+    count  : int
+
+    @property
+    def size(self):
+        return struct.calcsize(f'<{self.count}{self.format}')
+
+
+@dataclass(frozen=True, init=False)
+class BufferLayout():
+    '''
+    Declarative description of the vertex data of a buffer, e.g.
+    BufferLayout(('COLOR', 'B', 4), ('TEXCOORD', 'e', 2), ('TEXCOORD1', 'f', 2))
+    Conversions between layouts match elements by name (see `compile_buffer_conversion`).
+    '''
+    elements: tuple[BufferElement]
+
+    def __init__(self, *elements):
+        object.__setattr__(self, 'elements', tuple(
+            element if type(element) is BufferElement else BufferElement(*element)
+            for element in elements
+        ))
+
+    @property
+    def stride(self):
+        return sum(element.size for element in self.elements)
+
+    @property
+    def offsets(self):
+        offsets = []
+        offset = 0
+        for element in self.elements:
+            offsets.append(offset)
+            offset += element.size
+        return offsets
+
+    def __str__(self):
+        return '({})'.format(', '.join(f'{element.name}:{element.count}{element.format}' for element in self.elements))
+
+
+@dataclass(frozen=True)
+class BufferConversionPlan():
+    '''
+    Conversion between two buffer layouts, compiled once by `compile_buffer_conversion`.
+    Instead of unpacking and packing every vertex, each element is processed for all
+    vertices at once: pass-through elements are copied with strided slices, and converted
+    elements are gathered, unpacked/packed in bulk, and scattered back.
+    '''
+    src_stride : int
+    dst_stride : int
+    copies     : tuple[tuple[int, int, int]]                    # = ((src_offset, dst_offset, size), ...)
+    converts   : tuple[tuple[int, BufferElement, int, BufferElement]] # = ((src_offset, src, dst_offset, dst), ...)
+    copy_all   : bool
+
+    def run(self, buffer, value_maps=None):
+        vcount = len(buffer) // self.src_stride
+        src_end = vcount * self.src_stride
+        dst_end = vcount * self.dst_stride
+
+        if self.copy_all:
+            # Same stride and pass-through elements stay in place:
+            # start from a copy and only overwrite the converted elements
+            new_buffer = bytearray(buffer[:src_end])
+        else:
+            new_buffer = bytearray(dst_end)
+            for src_offset, dst_offset, size in self.copies:
+                for b in range(size):
+                    new_buffer[dst_offset+b:dst_end:self.dst_stride] = buffer[src_offset+b:src_end:self.src_stride]
+
+        for src_offset, src, dst_offset, dst in self.converts:
+            data = bytearray(vcount * src.size)
+            for b in range(src.size):
+                data[b::src.size] = buffer[src_offset+b:src_end:self.src_stride]
+
+            values = struct.unpack(f'<{vcount * src.count}{src.format}', data)
+            if value_maps and dst.name in value_maps:
+                values = value_maps[dst.name](values)
+            # Normalized colours: unorm bytes <-> floats
+            if src.format == 'B' and dst.format in 'ef':
+                values = [v/255 for v in values]
+            elif src.format in 'ef' and dst.format == 'B':
+                values = [int(v*255) for v in values]
+
+            data = struct.pack(f'<{vcount * dst.count}{dst.format}', *values)
+            for b in range(dst.size):
+                new_buffer[dst_offset+b:dst_end:self.dst_stride] = data[b::dst.size]
+
+        return new_buffer
+
+
+@functools.lru_cache(maxsize=None)
+def compile_buffer_conversion(src_layout: BufferLayout, dst_layout: BufferLayout, src_stride: int = None, mapped_elements: tuple[str] = ()):
+    '''
+    Elements of `dst_layout` are filled from the element with the same name in `src_layout`.
+    Elements that are missing from the source, or don't fit into `src_stride` (vertex data
+    that doesn't saturate the layout), are zeroed. `mapped_elements` are always unpacked so
+    that `run` can pass their values through `value_maps`.
+    '''
+    src_stride = src_stride or src_layout.stride
+    src_elements = {
+        element.name: (offset, element)
+        for element, offset in zip(src_layout.elements, src_layout.offsets)
+        if offset + element.size <= src_stride
+    }
+
+    copies, converts = [], []
+    copy_all = src_stride == dst_layout.stride
+    for dst, dst_offset in zip(dst_layout.elements, dst_layout.offsets):
+        if dst.name not in src_elements:
+            copy_all = False
+            continue
+
+        src_offset, src = src_elements[dst.name]
+        if src == dst and dst.name not in mapped_elements:
+            copies.append((src_offset, dst_offset, dst.size))
+            copy_all = copy_all and src_offset == dst_offset
+        else:
+            converts.append((src_offset, src, dst_offset, dst))
+
+    return BufferConversionPlan(src_stride, dst_layout.stride, tuple(copies), tuple(converts), copy_all)
+
+
+@dataclass
+class BufferLayoutRemap():
+    old_layout : BufferLayout
+    new_layout : BufferLayout
+    stride     : int
+
+    def convert(self, buffer):
+        return compile_buffer_conversion(self.old_layout, self.new_layout, self.stride).run(buffer)
+
+
+@dataclass
+class BlendIndicesRemap():
+    old_indices: tuple[int]
+    new_indices: tuple[int]
+
+    def convert(self, buffer):
+        layout = buffer_layouts['blend']
+        remap  = dict(zip(self.old_indices, self.new_indices))
+        plan   = compile_buffer_conversion(layout, layout, mapped_elements=('BLENDINDICES',))
+        return plan.run(buffer, {
+            'BLENDINDICES': lambda values: [remap.get(vgx, vgx) for vgx in values]
+        })
+
+
+def get_buffer_layout(layout):
+    # hash_commands entries reference layouts by their name in buffer_layouts
+    return buffer_layouts[layout] if type(layout) is str else layout
+
+
+# Bytes read from the start of a buffer to guess its layout from
+LAYOUT_SAMPLE_SIZE = 1 << 14
+
+
+def get_layout_variants(layout):
+    # Layouts a texcoord buffer is commonly found in instead of the expected one:
+    # vertex colour as 4B or 4f, and each texcoord as 2e or 2f
+    alternatives = {('B', 4): ('B', 'f'), ('f', 4): ('f', 'B'), ('e', 2): ('e', 'f'), ('f', 2): ('f', 'e')}
+    variants = [()]
+    for element in layout.elements:
+        variants = [
+            variant + (BufferElement(element.name, alternative, element.count),)
+            for variant in variants
+            for alternative in alternatives.get((element.format, element.count), (element.format,))
+        ]
+    return [BufferLayout(*variant) for variant in variants]
+
+
+def is_plausible_element(element, values):
+    # Byte colours can be anything
+    if element.format not in 'ef':
+        return True
+    # Float colours are normalized
+    if element.name.startswith('COLOR'):
+        return all(-0.01 <= v <= 1.01 for v in values)
+    # Texcoords can tile but not by that much, and halfs read as floats (or the other way
+    # around) mostly come out as tiny or huge values that texcoords barely ever are
+    return all(v == 0 or 1e-3 <= abs(v) <= 64 for v in values)
+
+
+def get_layout_plausibility(sample, layout, stride):
+    # Share of the vertices in which the least plausible element of the layout is plausible
+    checked, plausible = 0, [0] * len(layout.elements)
+    for i in range(len(sample) // stride):
+        checked += 1
+        for j, (element, offset) in enumerate(zip(layout.elements, layout.offsets)):
+            # Elements past the stride of a truncated layout don't exist in the buffer
+            if offset + element.size > stride:
+                break
+            values = struct.unpack_from(f'<{element.count}{element.format}', sample, i*stride + offset)
+            if is_plausible_element(element, values):
+                plausible[j] += 1
+
+    element_count = sum(1 for offset in layout.offsets if offset < stride)
+    return min(plausible[:element_count]) / checked if checked else 0
+
+
+def infer_texcoord_layout(buffer, old_layout, new_layout, ini_stride, threshold=0.95, margin=0.02):
+    '''
+    Guesses the layout of a texcoord buffer from its size and the vertices at its start.
+    What the ini declares is believed: the old layout at the ini's stride (truncated, for
+    mods whose vertex data doesn't saturate the expected stride), or the new layout if the
+    ini already has its stride. Unless the buffer fits the new layout clearly better, or
+    fits it as well, which can't be told apart. Only when the buffer fits neither is it
+    matched against the colour/texcoord variants of the old layout.
+    Returns the (layout, stride)s the buffer fits: none, the one that explains it, or
+    the declared and the new one when it's ambiguous.
+    `buffer` is either the path of the buffer or its data.
+    '''
+    if isinstance(buffer, str):
+        buffer_size = os.path.getsize(buffer)
+        with open(buffer, 'rb') as f:
+            sample = f.read(LAYOUT_SAMPLE_SIZE)
+    else:
+        buffer_size, sample = len(buffer), buffer[:LAYOUT_SAMPLE_SIZE]
+
+    def get_fit(layout, stride):
+        if buffer_size == 0 or buffer_size % stride != 0:
+            return 0
+        return get_layout_plausibility(sample, layout, stride)
+
+    new_fit = get_fit(new_layout, new_layout.stride)
+    if ini_stride == new_layout.stride:
+        return [(new_layout, new_layout.stride)] if new_fit >= threshold else []
+
+    if ini_stride in get_layout_strides(old_layout):
+        declared_fit = get_fit(old_layout, ini_stride)
+        if declared_fit >= threshold and declared_fit >= new_fit + margin:
+            return [(old_layout, ini_stride)]
+        if new_fit >= threshold and new_fit >= declared_fit + margin:
+            return [(new_layout, new_layout.stride)]
+        if declared_fit >= threshold:
+            return [(old_layout, ini_stride), (new_layout, new_layout.stride)]
+    elif new_fit >= threshold:
+        return [(new_layout, new_layout.stride)]
+
+    # Neither explains the buffer, the best fitting variant does if there is one
+    fits = {}
+    for layout in get_layout_variants(old_layout):
+        for stride in {layout.stride, ini_stride} & set(get_layout_strides(layout)):
+            fits[(layout, stride)] = get_fit(layout, stride)
+    best_fit = max(fits.values(), default=0)
+    best = [variant for variant, fit in fits.items() if fit == best_fit]
+    return best if best_fit >= threshold and len(best) == 1 else []
+
+
+def get_layout_strides(layout):
+    # Strides of the layout and of its truncations, one per element it ends with
+    strides, stride = [], 0
+    for element in layout.elements:
+        stride += element.size
+        strides.append(stride)
+    return strides
+
+
+# Runs in the worker processes, so it has to stay a module level function
+# and only take/return picklable values. The buffer is either a path or the data itself.
+def convert_buffer(buffer, conversions):
+    original = Path(buffer).read_bytes() if isinstance(buffer, str) else buffer
+    buffer = original
+    for conversion in conversions:
+        buffer = conversion.convert(buffer)
+    return original, buffer
+
+
+def is_picklable(value):
+    # Classes a fix table plugin defines belong to no importable module (runpy's <run_path>)
+    try:
+        pickle.dumps(value)
+    except (pickle.PicklingError, AttributeError, TypeError):
+        return False
+    return True
+
 
-        return default_args
+def get_buffer_pool():
+    # Starting worker processes is slow (especially on Windows),
+    # so a single pool is shared by all inis of a run
+    global buffer_pool
+    if buffer_pool is None:
+        buffer_pool = ProcessPoolExecutor(max_workers=buffer_workers)
+    return buffer_pool
 
-    def save(self):
-        if self._touched:
-            basename = os.path.basename(self.filepath).split('.ini')[0]
-            dir_path = os.path.abspath(self.filepath.split(basename+'.ini')[0])
-            backup_filename = f'DISABLED_BACKUP_{int(time.time())}.{basename}.ini'
-            backup_fullpath = os.path.join(dir_path, backup_filename)
-
-            os.rename(self.filepath, backup_fullpath)
-            print(f'Created Backup: {backup_filename} at {dir_path}')
-            with open(self.filepath, 'w', encoding=self.encoding) as updated_ini:
-                updated_ini.write(self.content)
-            # with open('DISABLED_BACKUP_debug.ini', 'w', encoding='utf-8') as updated_ini:
-            #     updated_ini.write(self.content)
-
-            if len(self.modified_buffers) > 0:
-                print('Writing updated buffers')
-                for filepath, data in self.modified_buffers.items():
-                    with open(filepath, 'wb') as f:
-                        f.write(data)
-                    print('\tSaved: {}'.format(filepath))
 
-            print('Updates applied')
-        else:
-            print('No changes applied')
-        print()
+def undo_buffer_patch(patch_filepath, buffer_filepath):
+    # .patch files left beside the mods by older versions
+    apply_undo_patch(Path(patch_filepath).read_bytes(), buffer_filepath)
 
-    def has_hash(self, hash):
-        return (
-            (hash in self._hashes)
-            or (hash in self._done_hashes)
-        )
+
+def apply_undo_patch(patch, buffer_filepath):
+    if patch[:4] != BufferPatch.MAGIC:
+        raise Exception('Not a buffer patch')
+
+    size, range_count = struct.unpack_from('<QI', patch, 4)
+    if os.path.getsize(buffer_filepath) != size:
+        raise Exception('Buffer size of {} does not match the patch'.format(buffer_filepath))
+
+    offset = 4 + struct.calcsize('<QI')
+    with open(buffer_filepath, 'r+b') as f:
+        for _ in range(range_count):
+            start, length = struct.unpack_from('<QI', patch, offset)
+            offset += struct.calcsize('<QI')
+            f.seek(start)
+            f.write(patch[offset:offset + length])
+            offset += length
 
 
 # MARK: Commands
@@ -224,6 +2431,137 @@ def get_critical_content(section):
     return '\n'.join(critical_lines), hash, match_first_index
 
 
+# Lines that only mean something in the TextureOverride section itself and can't be moved
+# to a CommandList (on top of all match_* lines): the settings 3DMigoto reads from the section
+section_only_keys = (
+    'hash', 'filter_index', 'allow_duplicate_hash', 'depth_filter',
+    'override_byte_stride', 'override_vertex_count', 'uav_byte_stride',
+    'format', 'width', 'height', 'width_multiply', 'height_multiply',
+    'iteration', 'analyse_options', 'model', 'expand_region_copy', 'deny_cpu_read', 'stereomode',
+)
+section_header_pattern = re.compile(r'^[ \t]*\[([^\]\n]*)\].*$', flags=re.MULTILINE)
+
+
+def share_section_bodies(content, added_sections):
+    '''
+    TextureOverride sections with the same body, apart from their hash and match_* lines,
+    get that body moved to a [CommandList...] they all run instead. Only done for groups with
+    a section from `added_sections` (lowercase titles) in them, and when it makes the ini
+    smaller. Returns (content, number of sections sharing a body, number of CommandLists).
+    '''
+    headers = list(section_header_pattern.finditer(content))
+    titles  = {header.group(1).lower() for header in headers}
+
+    groups = {}
+    for header, next_header in zip(headers, headers[1:] + [None]):
+        title = header.group(1)
+        if not title.lower().startswith('textureoverride'):
+            continue
+
+        body_end = next_header.start() if next_header else len(content)
+        lines = content[header.end():body_end].rstrip().split('\n')[1:]
+        kept_lines, moved_lines = [], []
+        for line in lines:
+            # Commented out hash lines (left by update_hash) stay with their section too
+            key = line.split('=', 1)[0].strip(' \t;').lower() if '=' in line else None
+            if key in section_only_keys or (key and key.startswith('match_')):
+                kept_lines.append(line)
+            else:
+                moved_lines.append(line.rstrip())
+
+        if any(line.strip() and not line.strip().startswith(';') for line in moved_lines):
+            span = (header.end(), header.end() + len(content[header.end():body_end].rstrip()))
+            groups.setdefault(tuple(moved_lines), []).append((title, header.start(), span, kept_lines))
+
+    edits = []
+    shared_count, commandlist_count = 0, 0
+    for moved_lines, sections in groups.items():
+        if len(sections) < 2 or not any(title.lower() in added_sections for title, _, _, _ in sections):
+            continue
+
+        commandlist_title = 'CommandList' + sections[0][0][len('TextureOverride'):]
+        while commandlist_title.lower() in titles:
+            commandlist_title += '.Shared'
+        titles.add(commandlist_title.lower())
+
+        body = '\n'.join(moved_lines)
+        run_line = 'run = {}'.format(commandlist_title)
+        if len(body) * (len(sections) - 1) <= len(commandlist_title) + 4 + len(run_line) * len(sections):
+            continue
+
+        # The CommandList goes right before the first of the sections
+        first_start = sections[0][1]
+        edits.append((first_start, first_start, '[{}]\n{}\n\n'.format(commandlist_title, body)))
+        for _, _, (start, end), kept_lines in sections:
+            edits.append((start, end, '\n' + '\n'.join(kept_lines + [run_line])))
+        shared_count      += len(sections)
+        commandlist_count += 1
+
+    # The CommandList is inserted before the body of the first section is replaced
+    return apply_span_edits(content, sorted(edits)), shared_count, commandlist_count
+
+
+def apply_span_edits(content, edits):
+    '''
+    Returns the content with each (start, end, replacement) edit applied, replacing content[start:end]
+    (an insertion when start == end). The edits are sorted and don't overlap. The new content is
+    joined from its parts at the end, so the bulk edits don't copy it over once per edit.
+    '''
+    parts = []
+    prev_end = 0
+    for start, end, replacement in edits:
+        if start < prev_end:
+            raise Exception('Overlapping edits at {}'.format(start))
+        parts.append(content[prev_end:start])
+        parts.append(replacement)
+        prev_end = end
+    parts.append(content[prev_end:])
+    return ''.join(parts)
+
+
+# Slots of the section templates, a lone 🤍 is a slot nothing can be captured for
+section_template_slot_pattern = re.compile('(🤍[^🤍]*🤍|🍰|🌲|🤍)')
+
+
+@dataclass(frozen=True)
+class SectionTemplate():
+    '''
+    Content of a section to create, with slots for what earlier commands of the hash captured
+    into their data: 🍰 (the content of a section), 🤍<match_first_index>🤍 (the content of the
+    indexed section) and 🌲 (a position). The parts alternate between literal text and slots.
+    '''
+    parts: tuple[str, ...]
+
+    def fill(self, data):
+        # Returns the content and the slots nothing was captured for, which are left as they are
+        parts = list(self.parts)
+        missing_slots = []
+        for i in range(1, len(parts), 2):
+            value = data.get(parts[i])
+            if value is None:
+                missing_slots.append(parts[i])
+            else:
+                parts[i] = value
+        return ''.join(parts), missing_slots
+
+
+# Compiled templates are cached, the commands create the same sections over and over
+@functools.lru_cache(maxsize=4096)
+def get_section_template(template) -> SectionTemplate:
+    return SectionTemplate(tuple(section_template_slot_pattern.split(template)))
+
+
+# Line boundaries str.splitlines knows of besides \n
+line_boundary_pattern = re.compile('[\r\v\f\x1c\x1d\x1e\x85\u2028\u2029]')
+
+
+def comment_out(text):
+    # Every line of the text commented, the lines being split like str.splitlines does
+    if text and not text.endswith('\n') and not line_boundary_pattern.search(text):
+        return '; ' + text.replace('\n', '\n; ')
+    return '\n'.join(['; ' + line for line in text.splitlines()])
+
+
 # Returns all resources used by a commandlist
 # Hardcoded to only return vb1 i.e. texcoord resources for now
 # (TextureOverride sections are special commandlists)
@@ -332,22 +2670,15 @@ class comment_sections():
         hash = default_args.hash
 
         pattern = get_section_hash_pattern(hash)
-        new_ini_content = ''   # ini content with all matching sections commented
+        edits   = []   # all matching sections commented
 
-        prev_j = 0
-        commented_count = 0
-        section_matches = pattern.finditer(ini.content)
+        section_matches = pattern.finditer(ini.content, ini.get_hash_section_start(hash))
         for section_match in section_matches:
             i, j = section_match.span(1)
-            commented_section = '\n'.join(['; ' + line for line in section_match.group(1).splitlines()])
-            commented_count  += 1
+            edits.append((i, j, comment_out(section_match.group(1))))
+        commented_count = len(edits)
 
-            new_ini_content += ini.content[prev_j:i] + commented_section
-            prev_j = j
-
-        new_ini_content += ini.content[prev_j:]
-        
-        ini.content = new_ini_content
+        ini.content = apply_span_edits(ini.content, edits)
 
         return ExecutionResult(
             touched        = True,
@@ -368,22 +2699,15 @@ class comment_commandlists():
         ini  = default_args.ini
 
         pattern = get_section_title_pattern(self.commandlist_title)
-        new_ini_content = ''   # ini content with matching commandlist commented out
+        edits   = []   # matching commandlists commented out
 
-        prev_j = 0
-        commented_count = 0
         commandlist_matches = pattern.finditer(ini.content)
         for commandlist_match in commandlist_matches:
             i, j = commandlist_match.span(1)
-            commented_commandlist = '\n'.join(['; ' + line for line in commandlist_match.group(1).splitlines()])
-            commented_count  += 1
+            edits.append((i, j, comment_out(commandlist_match.group(1))))
+        commented_count = len(edits)
 
-            new_ini_content += ini.content[prev_j:i] + commented_commandlist
-            prev_j = j
-
-        new_ini_content += ini.content[prev_j:]
-        
-        ini.content = new_ini_content
+        ini.content = apply_span_edits(ini.content, edits)
 
         return ExecutionResult(
             touched        = True,
@@ -407,7 +2731,7 @@ class remove_section():
         data        = default_args.data
 
         pattern = get_section_hash_pattern(active_hash)
-        section_match = pattern.search(ini.content)
+        section_match = pattern.search(ini.content, ini.get_hash_section_start(active_hash))
         if not section_match: raise Exception('Bad regex')
         start, end = section_match.span(1)
 
@@ -438,12 +2762,11 @@ class remove_indexed_sections():
         hash = default_args.hash
         data = default_args.data
         
-        pattern = get_section_hash_pattern(hash)
-        new_ini_content = ''   # ini with ib sections removed
-        position        = -1   # First Occurence Deletion Start Position
-        prev_end         = 0
+        pattern  = get_section_hash_pattern(hash)
+        edits    = []   # ib sections removed
+        position = -1   # First Occurence Deletion Start Position
 
-        section_matches = pattern.finditer(ini.content)
+        section_matches = pattern.finditer(ini.content, ini.get_hash_section_start(hash))
         for section_match in section_matches:
             if re.search(r'\n\s*match_first_index\s*=', section_match.group(1), flags=re.IGNORECASE):
                 if self.capture_indexed_content:
@@ -460,11 +2783,9 @@ class remove_indexed_sections():
             if position == -1:
                 position = start
 
-            new_ini_content += ini.content[prev_end:start]
-            prev_end = end
+            edits.append((start, end, ''))
 
-        new_ini_content += ini.content[prev_end:]
-        ini.content = new_ini_content
+        ini.content = apply_span_edits(ini.content, edits)
 
         if self.capture_position:
             data[self.capture_position] = str(position)
@@ -489,7 +2810,7 @@ class capture_section():
         data        = default_args.data
 
         pattern = get_section_hash_pattern(active_hash)
-        section_match = pattern.search(ini.content)
+        section_match = pattern.search(ini.content, ini.get_hash_section_start(active_hash))
         if not section_match: raise Exception('Bad regex')
         _, end = section_match.span(1)
 
@@ -521,30 +2842,26 @@ class create_new_section():
         if self.saved_position and self.saved_position in data:
             pos = int(data[self.saved_position])
 
-        for placeholder, value in data.items():
-            if placeholder.startswith('_'):
-                # conditions are not to be used for substitution
-                continue
-            self.section_content = self.section_content.replace(placeholder, value)
+        # Conditions (data starting with _) are never slots, so they're not substituted
+        section_content, missing_slots = get_section_template(self.section_content).fill(data)
 
         # Half broken/fixed mods' ini will not have the object indices we're expecting
         # Could also be triggered due to a typo in the hash commands
-        for emoji in ['🍰', '🌲', '🤍']:
-            if emoji in self.section_content:
-                print('Section substitution failed')
-                print(self.section_content)
-                return ExecutionResult(
-                    touched        = False,
-                    failed         = True,
-                    signal_break   = False,
-                    queue_hashes   = None,
-                    queue_commands = None
-                )
+        if missing_slots:
+            print('Section substitution failed, nothing was captured for {}'.format(' '.join(missing_slots)))
+            print(section_content)
+            return ExecutionResult(
+                touched        = False,
+                failed         = True,
+                signal_break   = False,
+                queue_hashes   = None,
+                queue_commands = None
+            )
   
         if self.capture_position:
-            data[self.capture_position] = str(len(self.section_content) + pos)
+            data[self.capture_position] = str(len(section_content) + pos)
 
-        ini.content = ini.content[:pos] + self.section_content + ini.content[pos:]
+        ini.content = ini.content[:pos] + section_content + ini.content[pos:]
 
         return ExecutionResult(
             touched        = True,
@@ -564,57 +2881,78 @@ class transfer_indexed_sections():
         ini         = default_args.ini
         hash        = default_args.hash
 
-        title = None
-        p = get_section_hash_pattern(hash)
-        ib_matches = p.findall(ini.content)
+        # The IB sections of the hash are read once, their content captured by match_first_index
+        # (🍰 for the unindexed one). They are all removed, and the restructured sections take the
+        # place of the first one, in a single edit.
+        title    = None
+        captured = {}
+        edits    = []
         indexed_ib_count = 0
-        for m in ib_matches:
-            if re.search(r'\n\s*match_first_index\s*=', m):
+        p = get_section_hash_pattern(hash)
+        for section_match in p.finditer(ini.content, ini.get_hash_section_start(hash)):
+            section = section_match.group(1)
+            critical_content, _, match_first_index = get_critical_content(section)
+            if match_first_index is not None:
                 indexed_ib_count += 1
-                if not title: title = re.match(r'^\[TextureOverride(.*?)\]', m, flags=re.IGNORECASE).group(1)[:-1]
+                captured[f'🤍{match_first_index}🤍'] = critical_content
+                if not title: title = re.match(r'^\[TextureOverride(.*?)\]', section, flags=re.IGNORECASE).group(1)[:-1]
             else:
-                if not title: title = re.match(r'^\[TextureOverride(.*?)\]', m, flags=re.IGNORECASE).group(1)[:-2]
+                captured['🍰'] = critical_content
+                if not title: title = re.match(r'^\[TextureOverride(.*?)\]', section, flags=re.IGNORECASE).group(1)[:-2]
+            edits.append((*section_match.span(), ''))
 
         if indexed_ib_count == 0:
             return ExecutionResult()
 
-        unindexed_ib_content = '\n'.join([
-            f'[TextureOverride{title}IB]',
-            f'hash = {hash}',
-            '🍰',
-            '',
-            ''
-        ])
+        sections = []
+        if indexed_ib_count < len(edits):
+            sections.append('\n'.join([
+                f'[TextureOverride{title}IB]',
+                f'hash = {hash}',
+                '🍰',
+                '',
+                ''
+            ]))
 
         alpha = [
             'A', 'B', 'C', 'D', 'E', 'F', 'G', 'H', 'I', 'J',
             'K', 'L', 'M', 'N', 'O', 'P', 'Q', 'R', 'S', 'T',
             'U', 'V', 'W', 'X', 'Y', 'Z'
         ]
-        content = ''
         for i, (trg_index, src_index) in enumerate(zip(self.trg_indices, self.src_indices)):
-            content += '\n'.join([
+            sections.append('\n'.join([
                 f'[TextureOverride{title}{alpha[i]}]',
                 f'hash = {hash}',
                 f'match_first_index = {trg_index}',
                 f'🤍{src_index}🤍' if src_index != '-1' else 'ib = null',
                 '',
                 ''
-            ])
+            ]))
+
+        # Half broken/fixed mods' ini will not have the object indices we're expecting,
+        # their sections are left as they are
+        section_content, missing_slots = get_section_template(''.join(sections)).fill(captured)
+        if missing_slots:
+            print('Section substitution failed, nothing was captured for {}'.format(' '.join(missing_slots)))
+            print(section_content)
+            return ExecutionResult(
+                touched        = False,
+                failed         = True,
+                signal_break   = False,
+                queue_hashes   = None,
+                queue_commands = None
+            )
+
+        start, end, _ = edits[0]
+        edits[0] = (start, end, section_content)
+        ini.content = apply_span_edits(ini.content, edits)
 
         return ExecutionResult(
-            touched        = False,
+            touched        = True,
             failed         = False,
             signal_break   = False,
             queue_hashes   = None,
-            queue_commands = (
-                (remove_indexed_sections, {'capture_content': '🍰', 'capture_indexed_content': '🤍', 'capture_position': '🌲'}),
-                (create_new_section,      {'saved_position': '🌲', 'section_content': content}),
-                (create_new_section,      {'saved_position': '🌲', 'section_content': unindexed_ib_content}),
-            ) if indexed_ib_count < len(ib_matches) else (
-                (remove_indexed_sections, {'capture_indexed_content': '🤍', 'capture_position': '🌲'}),
-                (create_new_section,      {'saved_position': '🌲', 'section_content': content}),
-            ),
+            queue_commands = None
         )
 
 
@@ -628,18 +2966,21 @@ class multiply_section_if_missing():
 
         if (type(self.equiv_hashes) is not tuple):
             self.equiv_hashes = (self.equiv_hashes,)
-        for equiv_hash in self.equiv_hashes:
-            if ini.has_hash(equiv_hash):
-                return ExecutionResult(
-                    touched        = False,
-                    failed         = False,
-                    signal_break   = False,
-                    queue_hashes   = None,
-                    queue_commands = (
-                        (log, ('/ Skipping Section Multiplication',  f'{equiv_hash}', f'[...{self.extra_title}]',)),
-                    ),
-                )
+        equiv_hash = ini.get_equivalent_hash(self.equiv_hashes[0])
+        if equiv_hash is not None:
+            # Log the declared hash that is present if there is one
+            equiv_hash = next((h for h in self.equiv_hashes if ini.has_hash(h)), equiv_hash)
+            return ExecutionResult(
+                touched        = False,
+                failed         = False,
+                signal_break   = False,
+                queue_hashes   = None,
+                queue_commands = (
+                    (log, ('/ Skipping Section Multiplication',  f'{equiv_hash}', f'[...{self.extra_title}]',)),
+                ),
+            )
         equiv_hash = self.equiv_hashes[0]
+        ini.added_sections.add(f'TextureOverride{self.extra_title}'.lower())
 
         content = '\n'.join([
             '',
@@ -664,16 +3005,23 @@ class multiply_section_if_missing():
 
 @dataclass()
 class add_ib_check_if_missing():
+    '''
+    Adds `run = CommandListSkinTexture` to the IB sections of the hash that lack it: after the
+    `match_first_index` line of the indexed sections, or after the hash line of the unindexed
+    section when there are no indexed ones. The sections are then put back together where the
+    first of them was, the (last) unindexed section first. Done with a single search through the
+    sections of the hash and a single copy of the ini.
+    '''
 
     def execute(self, default_args: DefaultArgs):
         ini  = default_args.ini
         hash = default_args.hash
         
         pattern         = get_section_hash_pattern(hash)
-        section_matches = pattern.finditer(ini.content)
+        section_matches = list(pattern.finditer(ini.content, ini.get_hash_section_start(hash)))
 
         needs_check       = False
-        new_sections      = ''
+        new_sections      = []
         unindexed_section = ''
 
         for section_match in section_matches:
@@ -682,16 +3030,16 @@ class add_ib_check_if_missing():
                 continue
 
             if re.search(r'\n\s*run\s*=\s*CommandListSkinTexture', section_match.group(1), flags=re.IGNORECASE):
-                new_sections += section_match.group()
+                new_sections.append(section_match.group())
                 continue
 
             needs_check = True
-            new_sections += re.sub(
+            new_sections.append(re.sub(
                 r'\n\s*match_first_index\s*=.*?\n',
                 r'\g<0>run = CommandListSkinTexture\n',
                 section_match.group(),
                 flags=re.IGNORECASE, count=1
-            )
+            ))
 
 
         if unindexed_section and not new_sections:
@@ -704,19 +3052,29 @@ class add_ib_check_if_missing():
                     flags=re.IGNORECASE, count=1
                 )
 
-        new_sections = unindexed_section + new_sections
+        if not needs_check:
+            return ExecutionResult(
+                touched        = False,
+                failed         = False,
+                signal_break   = False,
+                queue_hashes   = None,
+                queue_commands = (
+                    (log, ('/ Skipping `run = CommandListSkinTexture` Addition',)),
+                ),
+            )
+
+        # All sections are removed, the first one is replaced by all of them
+        edits = [(section_match.start(), section_match.end(), '') for section_match in section_matches]
+        edits[0] = (edits[0][0], edits[0][1], unindexed_section + ''.join(new_sections))
+        ini.content = apply_span_edits(ini.content, edits)
 
         return ExecutionResult(
-            touched        = False,
+            touched        = True,
             failed         = False,
             signal_break   = False,
             queue_hashes   = None,
             queue_commands = (
-                (log,                     ('+ Adding `run = CommandListSkinTexture`',)),
-                (remove_indexed_sections, {'capture_position': '🌲'}),
-                (create_new_section,      {'saved_position': '🌲', 'section_content': new_sections}),
-            ) if needs_check else (
-                (log,                     ('/ Skipping `run = CommandListSkinTexture` Addition',)),
+                (log, ('+ Adding `run = CommandListSkinTexture`',)),
             ),
         )
 
@@ -732,18 +3090,21 @@ class add_section_if_missing():
 
         if (type(self.equiv_hashes) is not tuple):
             self.equiv_hashes = (self.equiv_hashes,)
-        for equiv_hash in self.equiv_hashes:
-            if ini.has_hash(equiv_hash):
-                return ExecutionResult(
-                    touched        = False,
-                    failed         = False,
-                    signal_break   = False,
-                    queue_hashes   = None,
-                    queue_commands = (
-                        (log, ('/ Skipping Section Addition', equiv_hash, f'[...{self.section_title}]',)),
-                    ),
-                )
+        equiv_hash = ini.get_equivalent_hash(self.equiv_hashes[0])
+        if equiv_hash is not None:
+            # Log the declared hash that is present if there is one
+            equiv_hash = next((h for h in self.equiv_hashes if ini.has_hash(h)), equiv_hash)
+            return ExecutionResult(
+                touched        = False,
+                failed         = False,
+                signal_break   = False,
+                queue_hashes   = None,
+                queue_commands = (
+                    (log, ('/ Skipping Section Addition', equiv_hash, f'[...{self.section_title}]',)),
+                ),
+            )
         equiv_hash = self.equiv_hashes[0]
+        ini.added_sections.add(f'TextureOverride{self.section_title}'.lower())
 
         section = '\n[TextureOverride{}]\n'.format(self.section_title)
         section += 'hash = {}\n'.format(equiv_hash)
@@ -765,42 +3126,38 @@ class add_section_if_missing():
 @dataclass
 class zzz_13_remap_texcoord():
     id: str
-    old_format: tuple[str] # = ('4B','2e','2f','2e')
-    new_format: tuple[str] # = ('4B','2f','2f','2f')
+    old_format: BufferLayout | str # = 'texcoord_4B_2e_2f_2e'
+    new_format: BufferLayout | str # = 'texcoord_4B_2f_2f_2f'
 
     def execute(self, default_args: DefaultArgs):
         ini  = default_args.ini
         hash = default_args.hash
         tabs = default_args.tabs
 
-        # Precompute new buffer strides and offsets
+        # Precompute new buffer strides
         # Check if existing buffer stride matches our expectations
         # before remapping it
-        if (len(self.old_format) != len(self.new_format)): raise Exception()
-        old_stride = struct.calcsize('<' + ''.join(self.old_format))
-        new_stride = struct.calcsize('<' + ''.join(self.new_format))
-
-        offset = 0
-        offsets = [0]
-        for format_chunk in self.old_format:
-            offset += struct.calcsize(f'<{format_chunk}')
-            offsets.append(offset)
+        old_layout = get_buffer_layout(self.old_format)
+        new_layout = get_buffer_layout(self.new_format)
+        old_stride = old_layout.stride
+        new_stride = new_layout.stride
 
         # Debugging
-        # print(f'\t\tOld Format stride: {struct.calcsize('<' + ''.join(self.old_format))}')
-        # print(f'\t\tNew Format stride: {struct.calcsize('<' + ''.join(self.new_format))}')
+        # print(f'\t\tOld Layout: {old_layout} stride: {old_stride}')
+        # print(f'\t\tNew Layout: {new_layout} stride: {new_stride}')
         # print(f'\t\tBuffer Stride: {stride}')
-        # print(f'\t\tOffsets: {offsets}')
 
         # Need to find all Texcoord Resources used by this hash directly
         # through TextureOverrides or run through Commandlists... 
         pattern = get_section_hash_pattern(hash)
-        section_match = pattern.search(ini.content)
+        section_match = pattern.search(ini.content, ini.get_hash_section_start(hash))
         resources = process_commandlist(ini.content, section_match.group(1), 'vb1')
 
         # - Match Resource sections to find filenames of buffers 
-        # - Update stride value of resources early instead of iterating again later
+        # - Prepare the new stride values of the resources, only written once the buffers check out
         buffer_filenames = set()
+        resource_edits = {}
+        stride = None
         line_pattern = re.compile(r'^\s*(filename|stride)\s*=\s*(.*)\s*$', flags=re.IGNORECASE)
         for resource in resources:
             pattern = get_section_title_pattern(resource)
@@ -828,54 +3185,49 @@ class zzz_13_remap_texcoord():
                     modified_resource_section.append('stride = {}'.format(new_stride))
                     modified_resource_section.append(';'+line)
 
-            # Update ini
-            modified_resource_section = '\n'.join(modified_resource_section)
-            i, j = resource_section_match.span(1)
-            ini.content = ini.content[:i] + modified_resource_section + ini.content[j:]
+            resource_edits[resource_section_match.span(1)] = '\n'.join(modified_resource_section)
 
-        global global_modified_buffers
+        # Every buffer gets inspected before the ini is changed, a buffer that doesn't fit or is
+        # ambiguous raises so that the whole ini is left alone (the hash may already be updated)
+        fix_id = f'{self.id}-texcoord_remap'
+        remaps = {
+            # buffer_dict_key: BufferLayoutRemap, None if the buffer already has the new layout
+        }
         for buffer_filename in buffer_filenames:
-            buffer_filepath = Path(Path(ini.filepath).parent/buffer_filename)
-            buffer_dict_key = str(buffer_filepath.absolute())
-
-            if buffer_dict_key not in global_modified_buffers:
-                global_modified_buffers[buffer_dict_key] = []
-            fix_id = f'{self.id}-texcoord_remap'
-            if fix_id in global_modified_buffers[buffer_dict_key]: continue
-            else: global_modified_buffers[buffer_dict_key].append(fix_id)
-
-            if buffer_dict_key not in ini.modified_buffers:
-                buffer = buffer_filepath.read_bytes()
-            else:
-                buffer = ini.modified_buffers[buffer_dict_key]
-
-            vcount = len(buffer) // stride
-            new_buffer = bytearray()
-            for i in range(vcount):
-                for j, (old_chunk, new_chunk) in enumerate(zip(self.old_format, self.new_format)):
-
-                    if offsets[j] < stride and offsets[j+1] <= stride:
-
-                        if old_chunk != new_chunk:
-                            # HardCode VColor Remap
-                            if (j == 0 and old_chunk == '4B' and new_chunk == '4f'):
-                                new_buffer.extend(struct.pack('<4f', *[b/255 for b in struct.unpack_from('<4B', buffer, i*stride + 0)]))
-                            elif (j == 0 and old_chunk == '4f' and new_chunk == '4B'):
-                                new_buffer.extend(struct.pack('<4B', *[int(b*255) for b in struct.unpack_from('<4f', buffer, i*stride + 0)]))
+            buffer_dict_key = ini.get_buffer_key(buffer_filename)
+            if fix_id in ini.fixed_buffers.get(buffer_dict_key, ()) or buffer_dict_key in remaps:
+                continue
 
-                            # General Element Remap
-                            else:
-                                new_buffer.extend(struct.pack(f'<{new_chunk}', *struct.unpack_from(f'<{old_chunk}', buffer, i*stride+offsets[j])))
+            # A buffer that an earlier fix of this ini already converts can't be inspected as is
+            if buffer_dict_key in ini.buffer_conversions:
+                remaps[buffer_dict_key] = BufferLayoutRemap(old_layout, new_layout, stride)
+                continue
 
-                        # No Element Remap Needed
-                        else:
-                            new_buffer.extend(buffer[i*stride + offsets[j]: i*stride + offsets[j+1]])
+            # Cheap pre-pass before committing to the full conversion: make
+            # sure the buffer actually looks like the layout we remap from
+            layouts = infer_texcoord_layout(ini.get_buffer_source(buffer_dict_key), old_layout, new_layout, stride)
+            if not layouts:
+                raise Exception('Remap failed for {}! Buffer does not match the expected layout {} (stride {}).'.format(buffer_filename, old_layout, old_stride))
+            if len(layouts) > 1:
+                raise Exception('Remap failed for {}! Buffer fits both {}, which can\'t be told apart.'.format(
+                    buffer_filename, ' and '.join('{} (stride {})'.format(layout, layout_stride) for layout, layout_stride in layouts)
+                ))
+
+            buffer_layout, buffer_stride = layouts[0]
+            if buffer_layout == new_layout and buffer_stride == new_stride:
+                print('{}/ Skipping {}: Buffer already has the new layout {}'.format('\t'*tabs, buffer_filename, new_layout))
+                remaps[buffer_dict_key] = None
+                continue
+            if buffer_layout != old_layout or buffer_stride != stride:
+                print('{}X WARNING [{}]! Expected layout {} but detected {} with stride {}. Remapping from the detected layout.'.format('\t'*tabs, buffer_filename, old_layout, buffer_layout, buffer_stride))
+            remaps[buffer_dict_key] = BufferLayoutRemap(buffer_layout, new_layout, buffer_stride)
 
-                    # Mod texcoord vertex data does not saturate the expected old stride
-                    else: # cope
-                        new_buffer.extend(struct.pack(f'<{new_chunk}', *([0] * int(new_chunk[0]))))
-            
-            ini.modified_buffers[buffer_dict_key] = new_buffer    
+        # Update ini
+        ini.content = apply_span_edits(ini.content, sorted((i, j, text) for (i, j), text in resource_edits.items()))
+        for buffer_dict_key, remap in remaps.items():
+            ini.fixed_buffers.setdefault(buffer_dict_key, []).append(fix_id)
+            if remap is not None:
+                ini.queue_buffer_conversion(buffer_dict_key, remap)
 
         return ExecutionResult(
             touched=True
@@ -895,7 +3247,7 @@ class zzz_12_shrink_texcoord_color():
         # Need to find all Texcoord Resources used by this hash directly
         # through TextureOverrides or run through Commandlists... 
         pattern = get_section_hash_pattern(hash)
-        section_match = pattern.search(ini.content)
+        section_match = pattern.search(ini.content, ini.get_hash_section_start(hash))
         resources = process_commandlist(ini.content, section_match.group(1), 'vb1')
 
         # - Match Resource sections to find filenames of buffers 
@@ -929,36 +3281,19 @@ class zzz_12_shrink_texcoord_color():
             i, j = resource_section_match.span(1)
             ini.content = ini.content[:i] + modified_resource_section + ini.content[j:]
 
-        global global_modified_buffers
         for buffer_filename in buffer_filenames:
-            buffer_filepath = Path(Path(ini.filepath).parent/buffer_filename)
-            buffer_dict_key = str(buffer_filepath.absolute())
+            buffer_dict_key = ini.get_buffer_key(buffer_filename)
 
-            if buffer_dict_key not in global_modified_buffers:
-                global_modified_buffers[buffer_dict_key] = []
+            if buffer_dict_key not in ini.fixed_buffers:
+                ini.fixed_buffers[buffer_dict_key] = []
             fix_id = f'{self.id}-zzz_12_shrink_texcoord_color'
-            if fix_id in global_modified_buffers[buffer_dict_key]: continue
-            else: global_modified_buffers[buffer_dict_key].append(fix_id)
+            if fix_id in ini.fixed_buffers[buffer_dict_key]: continue
+            else: ini.fixed_buffers[buffer_dict_key].append(fix_id)
 
-            if buffer_dict_key not in ini.modified_buffers:
-                buffer = buffer_filepath.read_bytes()
-            else:
-                buffer = ini.modified_buffers[buffer_dict_key]
-
-            vcount = len(buffer) // stride
-            new_buffer = bytearray()
-            for i in range(vcount):
-                # print(*[ int((f*255)) for f in struct.unpack_from('<4f', buffer, i*stride + 0)])
-                new_buffer.extend(struct.pack(
-                        '<4B',
-                        *[
-                            int(f * 255)
-                            for f in struct.unpack_from('<4f', buffer, i*stride + 0)
-                        ]
-                    ))
-                new_buffer.extend(buffer[i*stride + 16: i*stride + stride])
-            
-            ini.modified_buffers[buffer_dict_key] = new_buffer            
+            # Float vertex colour shrunk to unorm bytes, the rest of the vertex is left as is
+            old_layout = BufferLayout(('COLOR', 'f', 4), *([('DATA', 'B', stride - 16)] if stride > 16 else []))
+            new_layout = BufferLayout(('COLOR', 'B', 4), *([('DATA', 'B', stride - 16)] if stride > 16 else []))
+            ini.queue_buffer_conversion(buffer_dict_key, BufferLayoutRemap(old_layout, new_layout, stride))
 
         return ExecutionResult(
             touched=True
@@ -976,7 +3311,7 @@ class update_buffer_blend_indices():
         # Need to find all Texcoord Resources used by this hash directly
         # through TextureOverrides or run through Commandlists... 
         pattern = get_section_hash_pattern(self.hash)
-        section_match = pattern.search(ini.content)
+        section_match = pattern.search(ini.content, ini.get_hash_section_start(self.hash))
         resources = process_commandlist(ini.content, section_match.group(1), 'vb2')
 
         # - Match Resource sections to find filenames of buffers 
@@ -1000,28 +3335,9 @@ class update_buffer_blend_indices():
                     buffer_filenames.add(line_match.group(2))
 
         for buffer_filename in buffer_filenames:
-            buffer_filepath = Path(Path(ini.filepath).parent/buffer_filename)
-            buffer_dict_key = str(buffer_filepath.absolute())
-
-            if buffer_dict_key not in ini.modified_buffers:
-                buffer = buffer_filepath.read_bytes()
-            else:
-                buffer = ini.modified_buffers[buffer_dict_key]
-    
-            new_buffer = bytearray()
-            blend_stride = 32
-            vertex_count = len(buffer)//blend_stride
-            for i in range(vertex_count):
-                blend_weights  = struct.unpack_from('<4f', buffer, i*blend_stride + 0)
-                blend_indices  = struct.unpack_from('<4I', buffer, i*blend_stride + 16)
+            buffer_dict_key = ini.get_buffer_key(buffer_filename)
 
-                new_buffer.extend(struct.pack('<4f4I', *blend_weights, *[
-                    vgx if vgx not in self.old_indices
-                    else self.new_indices[self.old_indices.index(vgx)]
-                    for vgx in blend_indices
-                ]))
-
-            ini.modified_buffers[buffer_dict_key] = new_buffer
+            ini.queue_buffer_conversion(buffer_dict_key, BlendIndicesRemap(self.old_indices, self.new_indices))
 
         return ExecutionResult(
             touched=True
@@ -1048,6 +3364,23 @@ class convert_to_slots():
 
 
 
+# MARK: Layouts
+# Vertex buffer layouts referenced by name from the hash commands.
+# A game patch that changes a layout only needs a new entry here.
+buffer_layouts = {
+    # Texcoord (vb1): vertex colour followed by the texcoords
+    'texcoord_4B_2e_2f_2e'   : BufferLayout(('COLOR', 'B', 4), ('TEXCOORD', 'e', 2), ('TEXCOORD1', 'f', 2), ('TEXCOORD2', 'e', 2)),
+    'texcoord_4f_2e_2f_2e'   : BufferLayout(('COLOR', 'f', 4), ('TEXCOORD', 'e', 2), ('TEXCOORD1', 'f', 2), ('TEXCOORD2', 'e', 2)),
+    'texcoord_4B_2f_2f_2f'   : BufferLayout(('COLOR', 'B', 4), ('TEXCOORD', 'f', 2), ('TEXCOORD1', 'f', 2), ('TEXCOORD2', 'f', 2)),
+    'texcoord_4B_2e_2f_2e_2e': BufferLayout(('COLOR', 'B', 4), ('TEXCOORD', 'e', 2), ('TEXCOORD1', 'f', 2), ('TEXCOORD2', 'e', 2), ('TEXCOORD3', 'e', 2)),
+    'texcoord_4f_2e_2f_2e_2e': BufferLayout(('COLOR', 'f', 4), ('TEXCOORD', 'e', 2), ('TEXCOORD1', 'f', 2), ('TEXCOORD2', 'e', 2), ('TEXCOORD3', 'e', 2)),
+    'texcoord_4B_2f_2f_2f_2f': BufferLayout(('COLOR', 'B', 4), ('TEXCOORD', 'f', 2), ('TEXCOORD1', 'f', 2), ('TEXCOORD2', 'f', 2), ('TEXCOORD3', 'f', 2)),
+
+    # Blend (vb2)
+    'blend'                  : BufferLayout(('BLENDWEIGHTS', 'f', 4), ('BLENDINDICES', 'I', 4)),
+}
+
+
 hash_commands = {
     # MARK: Anby
     '5c0240db': [(log, ('1.0: Anby Hair IB Hash',)), (add_ib_check_if_missing,)],
@@ -2008,8 +4341,8 @@ hash_commands = {
         (log,            ('+ Remapping texcoord buffer',)),
         (zzz_13_remap_texcoord, (
             '13_Caesar_hair',
-            ('4B','2e','2f','2e'),
-            ('4B','2f','2f','2f')
+            'texcoord_4B_2e_2f_2e',
+            'texcoord_4B_2f_2f_2f'
         )),
     ],
     '3b2a70a5': [
@@ -2018,8 +4351,8 @@ hash_commands = {
         (log,            ('+ Remapping texcoord buffer',)),
         (zzz_13_remap_texcoord, (
             '13_Caesar_body',
-            ('4B','2e','2f','2e', '2e'),
-            ('4B','2f','2f','2f', '2f')
+            'texcoord_4B_2e_2f_2e_2e',
+            'texcoord_4B_2f_2f_2f_2f'
         )),
     ],
 
@@ -2259,7 +4592,7 @@ hash_commands = {
         (log, ('1.0 -> 1.1: Ellen Hair Texcoord Hash',)),
         (update_hash, ('5c33833e',)),
         (log, ('+ Remapping texcoord buffer from stride 24 to 36',)),
-        (zzz_13_remap_texcoord, ('11_Ellen_Hair', ('4B', '2e', '2f', '2e', '2e'), ('4f', '2e', '2f', '2e', '2e'))), # attention
+        (zzz_13_remap_texcoord, ('11_Ellen_Hair', 'texcoord_4B_2e_2f_2e_2e', 'texcoord_4f_2e_2f_2e_2e')), # attention
     ],
 
     '5c33833e': [
@@ -3240,8 +5573,8 @@ hash_commands = {
         (log,            ('+ Remapping texcoord buffer',)),
         (zzz_13_remap_texcoord, (
             '13_koleda_hair',
-            ('4B','2e','2f','2e'),
-            ('4B','2f','2f','2f')
+            'texcoord_4B_2e_2f_2e',
+            'texcoord_4B_2f_2f_2f'
         )),
     ],
     'e3021a32': [
@@ -3250,8 +5583,8 @@ hash_commands = {
         (log,            ('+ Remapping texcoord buffer',)),
         (zzz_13_remap_texcoord, (
             '13_koleda_body',
-            ('4B','2e','2f','2e'),
-            ('4B','2f','2f','2f')
+            'texcoord_4B_2e_2f_2e',
+            'texcoord_4B_2f_2f_2f'
         )),
     ],
 
@@ -4140,59 +6473,59 @@ hash_commands = {
 
 
     # MARK: NicoleSkin
-    '6847bbbd': [(log, ('1.0: Nicole Hair IB Hash',)),    (add_ib_check_if_missing,)],
-    '5a4c1ef3': [(log, ('1.0: Nicole Body IB Hash',)),    (add_ib_check_if_missing,)],
+    '6847bbbd': [(log, ('1.0: NicoleSkin Hair IB Hash',)),    (add_ib_check_if_missing,)],
+    '5a4c1ef3': [(log, ('1.0: NicoleSkin Body IB Hash',)),    (add_ib_check_if_missing,)],
 
 
     '6d3868f9': [
-        (log,                           ('1.0: Nicole HairA Diffuse 2048p Hash',)),
+        (log,                           ('1.0: NicoleSkin HairA Diffuse 2048p Hash',)),
         (add_section_if_missing,        ('6847bbbd', 'Nicole.Hair.IB', 'match_priority = 0\n')),
         (multiply_section_if_missing,   ('7a45adcd', 'Nicole.HairA.Diffuse.1024')),
     ],
     '7a45adcd': [
-        (log,                           ('1.0: Nicole HairA Diffuse 1024p Hash',)),
+        (log,                           ('1.0: NicoleSkin HairA Diffuse 1024p Hash',)),
         (add_section_if_missing,        ('6847bbbd', 'Nicole.Hair.IB', 'match_priority = 0\n')),
         (multiply_section_if_missing,   ('6d3868f9', 'Nicole.HairA.Diffuse.2048')),
     ],
     '8c9c25d5': [
-        (log,                           ('2.0: Nicole HairA LightMap 2048p Hash',)),
+        (log,                           ('2.0: NicoleSkin HairA LightMap 2048p Hash',)),
         (add_section_if_missing,        ('6847bbbd', 'Nicole.Hair.IB', 'match_priority = 0\n')),
         (multiply_section_if_missing,   (('f3c21e41', '9adc04ed'), 'Nicole.HairA.LightMap.1024')),
     ],
     'f3c21e41': [
-        (log,                           ('2.0: Nicole HairA LightMap 1024p Hash',)),
+        (log,                           ('2.0: NicoleSkin HairA LightMap 1024p Hash',)),
         (add_section_if_missing,        ('6847bbbd', 'Nicole.Hair.IB', 'match_priority = 0\n')),
         (multiply_section_if_missing,   (('8c9c25d5', '1dfd9e16'), 'Nicole.HairA.LightMap.2048')),
     ],
 
 
     'f86ffe2c': [
-        (log,                           ('1.0: Nicole BodyA, BangbooA Diffuse 2048p Hash',)),
+        (log,                           ('1.0: NicoleSkin BodyA, BangbooA Diffuse 2048p Hash',)),
         (add_section_if_missing,        ('5a4c1ef3', 'Nicole.Body.IB', 'match_priority = 0\n')),
         (multiply_section_if_missing,   ('9ee9b402', 'Nicole.BodyA.Diffuse.1024')),
     ],
     '9ee9b402': [
-        (log,                           ('1.0: Nicole BodyA, BangbooA Diffuse 1024p Hash',)),
+        (log,                           ('1.0: NicoleSkin BodyA, BangbooA Diffuse 1024p Hash',)),
         (add_section_if_missing,        ('5a4c1ef3', 'Nicole.Body.IB', 'match_priority = 0\n')),
         (multiply_section_if_missing,   ('f86ffe2c', 'Nicole.BodyA.Diffuse.2048')),
     ],
     '80855e0f': [
-        (log,                           ('1.0: Nicole BodyA, BangbooA LightMap 2048p Hash',)),
+        (log,                           ('1.0: NicoleSkin BodyA, BangbooA LightMap 2048p Hash',)),
         (add_section_if_missing,        ('5a4c1ef3', 'Nicole.Body.IB', 'match_priority = 0\n')),
         (multiply_section_if_missing,   ('2b5aa784', 'Nicole.BodyA.LightMap.1024')),
     ],
     '2b5aa784': [
-        (log,                           ('1.0: Nicole BodyA, BangbooA LightMap 1024p Hash',)),
+        (log,                           ('1.0: NicoleSkin BodyA, BangbooA LightMap 1024p Hash',)),
         (add_section_if_missing,        ('5a4c1ef3', 'Nicole.Body.IB', 'match_priority = 0\n')),
         (multiply_section_if_missing,   ('80855e0f', 'Nicole.BodyA.LightMap.2048')),
     ],
     '95cabef3': [
-        (log,                           ('1.0: Nicole BodyA, BangbooA MaterialMap 2048p Hash',)),
+        (log,                           ('1.0: NicoleSkin BodyA, BangbooA MaterialMap 2048p Hash',)),
         (add_section_if_missing,        ('5a4c1ef3', 'Nicole.Body.IB', 'match_priority = 0\n')),
         (multiply_section_if_missing,   ('bb33129d', 'Nicole.BodyA.MaterialMap.1024')),
     ],
     'bb33129d': [
-        (log,                           ('1.0: Nicole BodyA, BangbooA MaterialMap 1024p Hash',)),
+        (log,                           ('1.0: NicoleSkin BodyA, BangbooA MaterialMap 1024p Hash',)),
         (add_section_if_missing,        ('5a4c1ef3', 'Nicole.Body.IB', 'match_priority = 0\n')),
         (multiply_section_if_missing,   ('95cabef3', 'Nicole.BodyA.MaterialMap.2048')),
     ],
@@ -4724,8 +7057,8 @@ hash_commands = {
     #     (log,            ('+ Remapping texcoord buffer',)),
     #     (zzz_13_remap_texcoord, (
     #         '13_Seth_Hair',
-    #         ('4B','2e','2f','2e'),
-    #         ('4f','2e','2f','2e')
+    #         'texcoord_4B_2e_2f_2e',
+    #         'texcoord_4f_2e_2f_2e'
     #     )),
     # ],
     'a72f760f': [
@@ -4734,8 +7067,8 @@ hash_commands = {
         (log,            ('+ Remapping texcoord buffer',)),
         (zzz_13_remap_texcoord, (
             '14_Seth_Hair',
-            ('4f','2e','2f','2e'),
-            ('4B','2e','2f','2e')
+            'texcoord_4f_2e_2f_2e',
+            'texcoord_4B_2e_2f_2e'
         )),
     ],
 
@@ -5964,10 +8297,348 @@ hash_commands = {
 }
 
 
+# MARK: Schedule
+# Hashes are processed phase by phase. A hash belongs to the earliest phase of
+# any of its commands, so a hash that gets renamed is always handled before
+# the sections of its new hash are multiplied or receive their IB checks.
+hash_command_phases = (
+    (update_hash, transfer_indexed_sections),
+    (zzz_13_remap_texcoord, zzz_12_shrink_texcoord_color, update_buffer_blend_indices),
+    (multiply_section_if_missing, add_section_if_missing),
+    (add_ib_check_if_missing,),
+)
+
+
+# '1.0: Anby Hair IB Hash', '1.5 -> 1.6: Anby FaceA Diffuse 1024p Hash', '1.6 - 2.0: Soldier0 Face IB Hash', ...
+log_tag_pattern = re.compile(r'^\s*(\d+)\.([\w?])\w*:?\s*(?:-+>?\s*(\d+)\.([\w?])[\w?]*:?\s*)?(\w+)')
+
+
+def get_hash_tags(commands):
+    '''
+    Returns the game version the hash is from, the version it got replaced in (None if it's
+    still in use) and the character it belongs to, as written in the first log of its commands.
+    (None, None, None) if there is none. Unknown minor versions (1.?, 1.x) count as 99.
+    '''
+    if not commands or commands[0][0] is not log:
+        return None, None, None
+
+    tag_match = log_tag_pattern.match(commands[0][1][0])
+    if not tag_match:
+        return None, None, None
+
+    major, minor, replaced_major, replaced_minor, character = tag_match.groups()
+    version = (int(major), int(minor) if minor.isdigit() else 99)
+    replaced_in = None
+    if replaced_major:
+        replaced_in = (int(replaced_major), int(replaced_minor) if replaced_minor.isdigit() else 99)
+    return version, replaced_in, character
+
+
+def compile_hash_schedule(hash_commands):
+    schedule = {}
+    for hash, commands in hash_commands.items():
+        phase = len(hash_command_phases)
+        for command in commands:
+            for i, phase_commands in enumerate(hash_command_phases):
+                if command[0] in phase_commands:
+                    phase = min(phase, i)
+
+        version, _, character = get_hash_tags(commands)
+        schedule[hash] = (phase, version or (0, 0), character or '')
+
+    return schedule
+
+
+hash_schedule = compile_hash_schedule(hash_commands)
+
+
+def get_hash_schedule_key(hash):
+    # Hashes without commands only get logged, get them out of the way first
+    return hash_schedule.get(hash, (-1, (0, 0), ''))
+
+
+def compile_hash_equivalence(hash_commands):
+    '''
+    Union-find over the `equiv_hashes` of all section adding commands: hashes declared
+    equivalent anywhere, directly or through hashes they share with other declarations,
+    end up in the same class. Returns {hash: class}, a class being one of its hashes.
+    '''
+    parents = {}
+
+    def find(hash):
+        parents.setdefault(hash, hash)
+        while parents[hash] != hash:
+            parents[hash] = parents[parents[hash]]
+            hash = parents[hash]
+        return hash
+
+    for commands in hash_commands.values():
+        for command in commands:
+            if command[0] not in (multiply_section_if_missing, add_section_if_missing):
+                continue
+            args = command[1]
+            equiv_hashes = args[0] if type(args) is tuple else args['equiv_hashes']
+            if type(equiv_hashes) is not tuple:
+                equiv_hashes = (equiv_hashes,)
+            for equiv_hash in equiv_hashes[1:]:
+                parents[find(equiv_hash)] = find(equiv_hashes[0])
+
+    return {hash: find(hash) for hash in parents}
+
+
+hash_equivalence = compile_hash_equivalence(hash_commands)
+
+
+def get_hash_class(hash):
+    # Hashes without any declared equivalents are a class of their own
+    return hash_equivalence.get(hash, hash)
+
+
+def compile_known_hashes(hash_commands):
+    # Every hash the table has commands for or mentions in the arguments of a command
+    hash_pattern = re.compile(r'^[a-f0-9]{8}$')
+    known = set(hash_commands)
+
+    def collect(value):
+        if type(value) in (tuple, list):
+            for item in value:
+                collect(item)
+        elif type(value) is dict:
+            for item in value.values():
+                collect(item)
+        elif type(value) is str and hash_pattern.match(value):
+            known.add(value)
+
+    for commands in hash_commands.values():
+        for command in commands:
+            if command[0] is not log:
+                collect(command[1:])
+
+    return frozenset(known)
+
+
+known_hashes = compile_known_hashes(hash_commands)
+
+
+def compile_hash_index(hash_commands):
+    '''
+    Tags the hashes by the character they belong to (the `# MARK:` group of the table they are in,
+    skins being groups of their own and Jane Doe tagged as Jane) and by the versions they were in
+    use in, as written in their logs. Returns {character: [hash, ...]} and {(version, replaced in):
+    [hash, ...]}, hashes without tags being under None/(None, None).
+    '''
+    characters = {}
+    versions   = {}
+    for hash, commands in hash_commands.items():
+        version, replaced_in, character = get_hash_tags(commands)
+        characters.setdefault(character, []).append(hash)
+        versions.setdefault((version, replaced_in), []).append(hash)
+
+    return characters, versions
+
+
+# The full table, hash_commands and the tables above are restricted to a part of it by select_hash_commands
+all_hash_commands = hash_commands
+character_index, version_index = compile_hash_index(hash_commands)
+
+
+def select_hash_commands(characters=None, since=None):
+    '''
+    Restricts hash_commands, and the schedule, equivalence classes and known hashes compiled from
+    it, to the hashes of the given characters (as tagged in the logs, in any case) that were still
+    in use in game version `since` (a (major, minor) tuple) or later. Inis without any of these
+    hashes are skipped as a whole by Ini.upgrade.
+    '''
+    global hash_commands, hash_schedule, hash_equivalence, known_hashes, hash_selection
+
+    selected = set(all_hash_commands)
+    description = []
+    if characters:
+        tags = {character.lower(): character for character in character_index if character}
+        unknown = [character for character in characters if character.lower() not in tags]
+        if unknown:
+            raise Exception('Unknown character(s): {} (known: {})'.format(', '.join(unknown), ', '.join(sorted(tags.values()))))
+        characters = [tags[character.lower()] for character in characters]
+        selected &= {hash for character in characters for hash in character_index[character]}
+        description.append(', '.join(characters))
+
+    if since:
+        # Hashes from the version on, or replaced after it (if ever)
+        selected &= {
+            hash for (version, replaced_in), hashes in version_index.items()
+            if version is not None and (replaced_in is None or replaced_in > since or version >= since)
+            for hash in hashes
+        }
+        description.append('since {}.{}'.format(*since))
+
+    hash_commands    = {hash: commands for hash, commands in all_hash_commands.items() if hash in selected}
+    hash_schedule    = compile_hash_schedule(hash_commands)
+    hash_equivalence = compile_hash_equivalence(hash_commands)
+    known_hashes     = compile_known_hashes(hash_commands)
+    hash_selection   = ' '.join(description)
+
+
+@dataclass()
+class FixTable():
+    '''
+    The hash commands of a 3DMigoto game, along with the buffer layouts they refer to by name.
+    `loader()` returns them as a namespace, it only gets called when `use_fix_tables` selects the game.
+    '''
+    game           : str
+    loader         : object
+    hash_commands  : dict = None
+    buffer_layouts : dict = None
+
+    def load(self):
+        if self.hash_commands is None:
+            namespace = self.loader()
+            if 'hash_commands' not in namespace:
+                raise Exception(f'The fix table of {self.game} has no hash_commands')
+            self.hash_commands  = namespace['hash_commands']
+            self.buffer_layouts = namespace.get('buffer_layouts', {})
+        return self
+
+
+fix_tables = {
+    # game (lowercase): FixTable
+}
+
+
+def register_fix_table(game, loader):
+    fix_tables[game.lower()] = FixTable(game, loader)
+
+
+register_fix_table('ZZZ', lambda table=hash_commands, layouts=dict(buffer_layouts): {'hash_commands': table, 'buffer_layouts': layouts})
+
+
+def discover_fix_tables(folder_path):
+    '''
+    Registers the fix table plugins of the folder: .py files named after their game (e.g. gimi.py)
+    defining `hash_commands`, and `buffer_layouts` for the layouts of their own. They are run with
+    the globals of this script, commands included, once `use_fix_tables` selects their game.
+    Conversions they define can't be sent to the buffer worker processes (they aren't in an
+    importable module), the buffers of an ini that uses them are converted one at a time.
+    '''
+    for filename in sorted(os.listdir(folder_path)):
+        if filename.endswith('.py') and not filename.startswith('_'):
+            filepath = os.path.join(folder_path, filename)
+            register_fix_table(filename[:-len('.py')], functools.partial(load_fix_table_plugin, filepath))
+
+
+def load_fix_table_plugin(filepath):
+    # The tables of this script are left out so that a plugin can't end up with them by accident
+    init_globals = {
+        name: value for name, value in globals().items()
+        if name not in ('hash_commands', 'all_hash_commands', 'buffer_layouts')
+    }
+    return runpy.run_path(filepath, init_globals=init_globals)
+
+
+def use_fix_tables(games=None):
+    '''
+    Loads the fix tables of the given games (all registered ones by default) and merges them into
+    the full table, so that a single pass over the mods applies all of them: every ini gets the
+    commands of whichever tables have its hashes. A hash in several tables keeps the commands of
+    the first one. Returns the tables used. Tables are loaded up front: which games the mods are
+    for is only known from their hashes, which are only known once the tables are loaded.
+    '''
+    global all_hash_commands, hash_commands, hash_schedule, hash_equivalence, known_hashes
+    global character_index, version_index
+
+    games = [game.strip().lower() for game in games if game.strip()] if games else list(fix_tables)
+    unknown = [game for game in games if game not in fix_tables]
+    if unknown:
+        raise Exception('Unknown game(s): {} (known: {})'.format(', '.join(unknown), ', '.join(table.game for table in fix_tables.values())))
+
+    tables = [fix_tables[game].load() for game in games]
+    merged = {}
+    owners = {}
+    for table in tables:
+        for name, layout in table.buffer_layouts.items():
+            if buffer_layouts.setdefault(name, layout) != layout:
+                raise Exception(f'The fix table of {table.game} redefines the buffer layout {name}')
+        for hash, commands in table.hash_commands.items():
+            if hash in merged:
+                print(f'{hash} is in the fix tables of {owners[hash]} and {table.game}, only the one of {owners[hash]} is used')
+                continue
+            merged[hash] = commands
+            owners[hash] = table.game
+
+    all_hash_commands = merged
+    hash_commands     = merged
+    hash_schedule     = compile_hash_schedule(hash_commands)
+    hash_equivalence  = compile_hash_equivalence(hash_commands)
+    known_hashes      = compile_known_hashes(hash_commands)
+    character_index, version_index = compile_hash_index(hash_commands)
+    return tables
+
+
 # MARK: Regex
+@dataclass(frozen=True)
+class HashOccurrence():
+    hash          : str
+    position      : int
+    section_title : str
+    section_start : int
+
+
+# Section headers and hash lines, the only lines the scanner cares about
+hash_scan_pattern = re.compile(r'^[ \t]*(?:\[([^\]\n]*)|hash[ \t]*=[ \t]*([a-f0-9]+))', flags=re.IGNORECASE|re.MULTILINE)
+
+
+def scan_hashes(content):
+    '''
+    Finds every (uncommented) hash line of the content in a single pass. Returns all hashes in
+    order of appearance, {known hash: [HashOccurrence, ...]} and the positions of the section
+    headers (lines starting with `[`). A hash's section starts at the last header before it,
+    which is also where a match of get_section_hash_pattern for the hash would have to start.
+    '''
+    hashes         = []
+    occurrences    = {}
+    section_starts = []
+    section_title, section_start = None, 0
+    for match in hash_scan_pattern.finditer(content):
+        title, hash = match.groups()
+        if hash is None:
+            section_title, section_start = title, match.start()
+            section_starts.append(section_start)
+            continue
+
+        hashes.append(hash)
+        # Section searches match hash lines by prefix ("hash = <hash>ff" included)
+        known_hash = hash[:8].lower()
+        if known_hash in known_hashes:
+            occurrences.setdefault(known_hash, []).append(HashOccurrence(known_hash, match.start(2), section_title, section_start))
+
+    return hashes, occurrences, section_starts
+
+
+def find_first_change(old, new, chunk_size=4096):
+    # Position of the first character that differs. Whole chunks are compared
+    # first so that long unchanged prefixes only take a few comparisons.
+    length = min(len(old), len(new))
+    i = 0
+    while i < length and old[i:i+chunk_size] == new[i:i+chunk_size]:
+        i += chunk_size
+    if i >= length:
+        return length
+
+    lo, hi = i, min(i + chunk_size, length)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if old[lo:mid+1] == new[lo:mid+1]:
+            lo = mid + 1
+        else:
+            hi = mid
+    return lo
+
+
+# The section locators below find the same spans as these regexes did, which are kept around
+# as their reference (see benchmark_section_locators). Their nested repetitions take quadratic
+# time on some inis (e.g. long runs of blank lines between a header and the hash line).
 # Using VERBOSE flag to ignore whitespace
 # https://docs.python.org/3/library/re.html#re.VERBOSE
-def get_section_hash_pattern(hash) -> re.Pattern:
+def get_section_hash_regex(hash) -> re.Pattern:
     return re.compile(
         r'''
             ^(
@@ -5987,7 +8658,7 @@ def get_section_hash_pattern(hash) -> re.Pattern:
     )
 
 
-def get_section_title_pattern(title) -> re.Pattern:
+def get_section_title_regex(title) -> re.Pattern:
     return re.compile(
         r'''
             ^(
@@ -6002,9 +8673,324 @@ def get_section_title_pattern(title) -> re.Pattern:
     )
 
 
+# Compiled locators are cached, they get requested for the same hashes over and over
+@functools.lru_cache(maxsize=4096)
+def get_section_hash_pattern(hash) -> 'SectionLocator':
+    # [TextureOverride...]/[ShaderOverride...] sections with a `hash = <hash>` line
+    return SectionLocator(
+        header_pattern = section_override_header_pattern,
+        hash_pattern   = re.compile(r'hash\s*=\s*{}[ \t]*'.format(hash), flags=re.IGNORECASE),
+    )
+
+
+@functools.lru_cache(maxsize=4096)
+def get_section_title_pattern(title) -> 'SectionLocator':
+    # Sections by title, the title is a (VERBOSE) regex
+    return SectionLocator(
+        header_pattern = re.compile(r'^[ \t]*?\[{}\]'.format(title), flags=re.VERBOSE|re.IGNORECASE|re.MULTILINE),
+    )
+
+
+# Lines that may start a section, and the parts of the lines the locators classify
+section_line_pattern             = re.compile(r'^[ \t]*\[', flags=re.MULTILINE)
+section_override_header_pattern  = re.compile(r'[ \t]*\[(?:Texture|Shader)Override.*\][ \t]*(?=\n)', flags=re.IGNORECASE)
+section_body_stop_pattern        = re.compile(r'^[ \t]*(?:\[|hash\s*=)', flags=re.IGNORECASE|re.MULTILINE)
+section_indent_pattern           = re.compile(r'[ \t]*')
+section_whitespace_pattern       = re.compile(r'\s*')
+section_hash_word_pattern        = re.compile(r'hash', flags=re.IGNORECASE)
+
+
+@dataclass(frozen=True)
+class SectionMatch():
+    '''
+    A section found by a SectionLocator, with the interface of the re.Match it replaces:
+    group 1 is the section, group 0 is the section along with the whitespace following it.
+    '''
+    string : str
+    spans  : tuple[tuple[int, int], tuple[int, int]]
+
+    def span(self, group=0):
+        return self.spans[group]
+
+    def start(self, group=0):
+        return self.spans[group][0]
+
+    def end(self, group=0):
+        return self.spans[group][1]
+
+    def group(self, group=0):
+        start, end = self.spans[group]
+        return self.string[start:end]
+
+
+@dataclass(frozen=True)
+class SectionLocator():
+    '''
+    Finds sections the way get_section_hash_regex/get_section_title_regex did, in linear time.
+    Sections by title start at the first matching header. Sections by hash can only start at
+    the last line starting with `[` before a hash line (the body of any header before that
+    stops there), so the hash lines are looked for and each such header is only tried once.
+    From the header on, lines get classified once: the body lines up to the hash line (no other
+    header or hash line may come first), then the lines up to the next header, of which the
+    section keeps the ones up to the last line starting with `$` or a word character.
+    Same interface as a re.Pattern.
+    '''
+    header_pattern : re.Pattern
+    hash_pattern   : re.Pattern = None
+
+    def search(self, string, pos=0):
+        if self.hash_pattern is None:
+            header = self.header_pattern.search(string, pos)
+            return self.match_section(string, header.start(), header.end()) if header else None
+
+        while True:
+            hash_line = self.hash_pattern.search(string, pos)
+            if hash_line is None:
+                return None
+            start = find_last_section_line(string, pos, hash_line.start())
+            if start is not None:
+                header = self.header_pattern.match(string, start)
+                end = self.match_hash_line(string, header.end()) if header else None
+                if end is not None:
+                    return self.match_section(string, start, end)
+            # The hash lines up to the next header belong to the one that was just tried
+            pos = hash_line.start() + 1
+
+    def finditer(self, string, pos=0):
+        match = self.search(string, pos)
+        while match is not None:
+            yield match
+            match = self.search(string, match.end())
+
+    def findall(self, string, pos=0):
+        return [match.group(1) for match in self.finditer(string, pos)]
+
+    def match_section(self, string, start, end):
+        # The section goes on until the last line starting with $ or a word character before the next
+        # header, looked for from the next header backwards (sections usually end with such a line)
+        if string.startswith('\n', end):
+            next_header = section_line_pattern.search(string, end + 1)
+            line_end = next_header.start() - 1 if next_header else len(string)
+            while line_end > end:
+                line_start = string.rfind('\n', end, line_end) + 1
+                first = section_indent_pattern.match(string, line_start, line_end).end()
+                if first < line_end and (string[first] in '$_' or string[first].isalnum()):
+                    end = line_end
+                    break
+                line_end = line_start - 1
+
+        return SectionMatch(string, ((start, section_whitespace_pattern.match(string, end).end()), (start, end)))
+
+    def match_hash_line(self, string, pos):
+        # End of the hash line, None if another header or hash line comes first. After every body
+        # line, the hash line is looked for past any whitespace (blank lines included), so it's
+        # either the line that ends the body or a body line whose indent isn't only spaces/tabs.
+        stop = section_body_stop_pattern.search(string, pos + 1)
+        body_end = stop.start() if stop else len(string)
+        if not section_hash_word_pattern.search(string, pos, body_end):
+            if stop is None:
+                return None
+            hash_line = self.hash_pattern.match(string, section_whitespace_pattern.match(string, body_end).end())
+            return hash_line.end() if hash_line else None
+
+        # The attempts within a run of blank lines all end up at the same line, so it's only tried once
+        skipped_from, skipped_to = -1, -1
+        while True:
+            if not skipped_from <= pos + 1 <= skipped_to:
+                skipped_from, skipped_to = pos + 1, section_whitespace_pattern.match(string, pos + 1).end()
+                hash_line = self.hash_pattern.match(string, skipped_to)
+                if hash_line is not None:
+                    return hash_line.end()
+
+            if pos + 1 == body_end:
+                return None
+            pos = string.find('\n', pos + 1)
+            if pos == -1:
+                return None
+
+
+def find_last_section_line(string, pos, end):
+    # Start of the last line starting with `[` (after spaces/tabs) between pos and end, None if there is none
+    line_end = end
+    while True:
+        bracket = string.rfind('[', pos, line_end)
+        if bracket == -1:
+            return None
+        newline = string.rfind('\n', pos, bracket)
+        if newline != -1:
+            line_start = newline + 1
+        elif pos == 0 or string[pos - 1] == '\n':
+            line_start = pos
+        else:
+            # The line started before pos
+            return None
+        if section_indent_pattern.match(string, line_start, bracket).end() == bracket:
+            return line_start
+        line_end = line_start
+
+
+# MARK: Benchmark
+def get_adversarial_inis(size):
+    # {name: (ini content, locator factory, argument)} of about `size` lines, built to make the regexes backtrack
+    hash = '0123abcd'
+    return {
+        'blank lines before the hash': (
+            '[TextureOverrideBlank]\n' + '\n' * size + 'hash = {}\n'.format(hash),
+            'hash', hash,
+        ),
+        'blank lines, no hash': (
+            '[TextureOverrideBlank]\n' + ' \t\n' * size + 'hash = ffffffff\n',
+            'hash', hash,
+        ),
+        'comment lines before the hash': (
+            '[TextureOverrideComments]\n' + '; hash = {}\n'.format(hash) * size + 'hash = {}\n'.format(hash),
+            'hash', hash,
+        ),
+        'headers without the hash': (
+            '[TextureOverrideOther]\n\n\n\n' * (size // 4) + '[TextureOverrideLast]\nhash = {}\n'.format(hash),
+            'hash', hash,
+        ),
+        'giant resource block': (
+            '[ResourceGiant]\n' + 'type = Buffer\n; comment\n   \n' * (size // 3) + '[CommandListEnd]\n',
+            'title', 'ResourceGiant',
+        ),
+        'resource block of comments': (
+            '[ResourceComments]\nfilename = a.buf\n' + ';\n' * size,
+            'title', 'ResourceComments',
+        ),
+    }
+
+
+def benchmark_section_locators(sizes=(1000, 2000, 4000, 8000), repeat=3):
+    '''
+    Times the section locators against the regexes they replaced on inis built to make the regexes
+    backtrack, checking that both find the same spans. Locator times should grow linearly with
+    the size of the ini (about doubling per row), some of the regex times grow quadratically.
+    '''
+    print('{:<32}{:>8}{:>12}{:>12}'.format('Case', 'Lines', 'Regex (s)', 'Locator (s)'))
+    for size in sizes:
+        for name, (content, kind, argument) in get_adversarial_inis(size).items():
+            if kind == 'hash':
+                regex, locator = get_section_hash_regex(argument), get_section_hash_pattern(argument)
+            else:
+                regex, locator = get_section_title_regex(argument), get_section_title_pattern(argument)
+
+            timings = []
+            for finder in (regex, locator):
+                started_at = time.perf_counter()
+                for _ in range(repeat):
+                    spans = [(match.span(), match.span(1)) for match in finder.finditer(content)]
+                timings.append((time.perf_counter() - started_at) / repeat)
+                if finder is regex:
+                    expected_spans = spans
+            if spans != expected_spans:
+                raise Exception('Section locator and regex disagree on: {}'.format(name))
+
+            print('{:<32}{:>8}{:>12.4f}{:>12.4f}'.format(name, size, *timings))
+
+
+def concatenate_span_edits(content, edits):
+    # How the commands used to build their new content, the reference for apply_span_edits
+    new_content = ''
+    prev_end = 0
+    for start, end, replacement in edits:
+        new_content += content[prev_end:start] + replacement
+        prev_end = end
+    return new_content + content[prev_end:]
+
+
+def benchmark_span_edits(section_count=10000, repeat=3):
+    '''
+    Times apply_span_edits against building the content by concatenation, and the commands
+    that use it, on an ini with `section_count` sections that all match (plus some that don't).
+    '''
+    hash = '0123abcd'
+    content = ''.join(
+        '[TextureOverrideBench{0}]\nhash = {1}\nmatch_first_index = {0}\nrun = CommandListSkinTexture\ndrawindexed = auto\n\n'
+        '[ResourceBench{0}]\ntype = Buffer\nfilename = Bench{0}.buf\n\n'.format(i, hash)
+        for i in range(section_count)
+    )
+    matches = list(get_section_hash_pattern(hash).finditer(content))
+    print('{} matched sections, {:.1f} MB of ini'.format(len(matches), len(content) / 1024**2))
+    print('{:<32}{:>12}'.format('Case', 'Time (s)'))
+
+    for name, edits in (
+        ('comment', [(*match.span(1), comment_out(match.group(1))) for match in matches]),
+        ('remove', [(*match.span(), '') for match in matches]),
+    ):
+        timings = []
+        for build in (concatenate_span_edits, apply_span_edits):
+            started_at = time.perf_counter()
+            for _ in range(repeat):
+                new_content = build(content, edits)
+            timings.append((time.perf_counter() - started_at) / repeat)
+            if build is concatenate_span_edits:
+                expected_content = new_content
+        if new_content != expected_content:
+            raise Exception('apply_span_edits and concatenation disagree on: {}'.format(name))
+        print('{:<32}{:>12.4f}'.format('{} (concatenation)'.format(name), timings[0]))
+        print('{:<32}{:>12.4f}'.format('{} (apply_span_edits)'.format(name), timings[1]))
+
+    for command in (comment_sections(), remove_indexed_sections()):
+        ini = Ini(None, content=content, buffer_provider=lambda buffer_filename: None)
+        started_at = time.perf_counter()
+        command.execute(DefaultArgs(hash=hash, ini=ini, tabs=2, data={}))
+        print('{:<32}{:>12.4f}'.format(type(command).__name__, time.perf_counter() - started_at))
+
+
+def get_blend_remap_buffer(vertex_count, seed=0):
+    # Blend buffer of vertices weighted to 1-4 neighbouring bones, unused slots being bone 0 at weight 0
+    rng = random.Random(seed)
+    vertices = []
+    for _ in range(vertex_count):
+        bone_count = rng.randint(1, 4)
+        bone = rng.randrange(128)
+        indices = [min(max(bone + rng.randint(-2, 2), 0), 127) for _ in range(bone_count)] + [0] * (4 - bone_count)
+        weights = [rng.random() for _ in range(bone_count)]
+        weights = [weight / sum(weights) for weight in weights] + [0.0] * (4 - bone_count)
+        vertices.append(struct.pack('<4f4I', *weights, *indices))
+    return b''.join(vertices)
+
+
+def benchmark_buffer_patches(vertex_count=100000):
+    '''
+    Times diffing a blend buffer before and after the blend remaps of the hash table, checking
+    that the patch turns one into the other and that it stays sparse: a remap only changes
+    a few index bytes per vertex, so it shouldn't get the whole buffer rewritten and backed up.
+    '''
+    old = get_blend_remap_buffer(vertex_count)
+    print('{} vertices, {:.1f} MB of blend buffer'.format(vertex_count, len(old) / 1024**2))
+    print('{:<12}{:>12}{:>12}{:>16}{:>12}'.format('Hash', 'Changed', 'Ranges', 'Undo patch', 'Time (s)'))
+
+    for hash, commands in all_hash_commands.items():
+        for command in commands:
+            if command[0] is not update_buffer_blend_indices:
+                continue
+
+            remap = command[0](*command[1])
+            new = BlendIndicesRemap(remap.old_indices, remap.new_indices).convert(old)
+            started_at = time.perf_counter()
+            patch = BufferPatch.diff(old, new)
+            elapsed = time.perf_counter() - started_at
+
+            patched = bytearray(old)
+            for start, end in patch.ranges:
+                patched[start:end] = new[start:end]
+            if patched != new:
+                raise Exception('Buffer patch of {} does not rebuild the remapped buffer'.format(hash))
+            if not patch.is_sparse():
+                raise Exception('Buffer patch of {} is not sparse: {} of {} bytes'.format(hash, patch.get_undo_patch_size(), patch.size))
+
+            print('{:<12}{:>12}{:>12}{:>16}{:>12.4f}'.format(
+                hash, format_size(patch.patched_bytes()), len(patch.ranges),
+                '{:.0%} of buffer'.format(patch.get_undo_patch_size() / patch.size), elapsed,
+            ))
+
 
 # MARK: RUN
 if __name__ == '__main__':
+    # Needed for the buffer worker processes of frozen (pyinstaller) builds
+    multiprocessing.freeze_support()
     try: main()
     except Exception as x:
         print('\nError Occurred: {}\n'.format(x))